@@ -31,6 +31,8 @@ import java.net.URI
 import java.net.http.HttpClient
 import java.net.http.HttpRequest
 import java.net.http.HttpResponse
+import java.nio.ByteBuffer
+import java.nio.ByteOrder
 import java.util.*
 import javax.swing.JFrame
 import javax.swing.JPanel
@@ -52,6 +54,8 @@ abstract class Evaluator(
     val lexerChannels: Array<Int> = arrayOf(Token.HIDDEN_CHANNEL)
 ) : Runnable {
     private val REPEATS: Int = 30
+    // Opt into the packed little-endian binary wire format of /eval_model with -Devaluator.binaryModelWire=true.
+    private val isBinaryModelWire: Boolean = System.getProperty("evaluator.binaryModelWire", "false").toBoolean()
 
     private fun postJson(client: HttpClient, uri: String, json: Any): HttpResponse<String> {
         val requestBody: String = jacksonObjectMapper().writeValueAsString(json)
@@ -74,10 +78,28 @@ abstract class Evaluator(
     }
 
     private fun evalWithModel(inputTokenIds: List<Int>, client: HttpClient): EvalWithModelResponse {
+        if (isBinaryModelWire)
+            return this.evalWithModelBinary(inputTokenIds, client)
         val response = this.postJson(client, "http://127.0.0.1:5000/eval_model", EvalWithModelRequest(inputTokenIds))
         return jacksonObjectMapper().readValue<EvalWithModelResponse>(response.body())
     }
 
+    private fun evalWithModelBinary(inputTokenIds: List<Int>, client: HttpClient): EvalWithModelResponse {
+        // Request: packed little-endian int32 token ids. Response: packed little-endian int16 hcodes, ns in 'X-Ns'.
+        val requestBody = ByteBuffer.allocate(inputTokenIds.size * Int.SIZE_BYTES).order(ByteOrder.LITTLE_ENDIAN)
+        inputTokenIds.forEach { requestBody.putInt(it) }
+        val request: HttpRequest =
+            HttpRequest.newBuilder().uri(URI.create("http://127.0.0.1:5000/eval_model"))
+                .setHeader("Content-Type", "application/octet-stream")
+                .setHeader("X-Token-Dtype", "int32")
+                .POST(HttpRequest.BodyPublishers.ofByteArray(requestBody.array()))
+                .build()
+        val response = client.send(request, HttpResponse.BodyHandlers.ofByteArray())
+        val ns = response.headers().firstValue("X-Ns").orElseThrow().toLong()
+        val hCodes = ByteBuffer.wrap(response.body()).order(ByteOrder.LITTLE_ENDIAN).asShortBuffer()
+        return EvalWithModelResponse(ns, List(hCodes.remaining()) { hCodes.get(it).toInt() })
+    }
+
     private fun setupPygmentsConnection(lang: String): HttpClient {
         val client = HttpClient.newBuilder().build()
         this.postJson(
@@ -549,7 +571,9 @@ abstract class Evaluator(
 
     private fun runModelAndGetNanos(modelClient: HttpClient, source: String): Long {
         val t0 = System.nanoTime()
-        val allTokens: List<Int> = lexerOf(CharStreams.fromString(source)).allTokens.map { it.type }.toList()
+        // Model inputs end with EOF, as the oracle's token sequences and the server's own lexing do.
+        val allTokens: List<Int> =
+            lexerOf(CharStreams.fromString(source)).allTokens.map { it.type }.toList() + Token.EOF
         val t1 = System.nanoTime()
         val evalRes: EvalWithModelResponse = this.evalWithModel(
             allTokens, modelClient
@@ -794,7 +818,11 @@ abstract class Evaluator(
     private fun fileToHTMLModel(filepath: String, modelLogName: String) {
         val modClient: HttpClient = this.setupModelConnection(modelLogName)
         File(filepath).readText(charset = Charsets.UTF_8).let { src ->
-            val allTokens = lexerOf(CharStreams.fromString(src)).allTokens
+            // Model inputs end with EOF, as the oracle's token sequences and the server's own lexing do.
+            val allTokens = lexerOf(CharStreams.fromString(src)).allTokens + CommonToken(Token.EOF, "<EOF>").also {
+                it.startIndex = src.length
+                it.stopIndex = src.length - 1
+            }
             val tokenIds = allTokens.map { it.type }.toList()
             val response: EvalWithModelResponse = this.evalWithModel(tokenIds, modClient)
             //
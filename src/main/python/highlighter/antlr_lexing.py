@@ -0,0 +1,75 @@
+import sys
+import importlib
+#
+import utils as utils
+
+# In-process lexing of raw source code into the token rule ids the models consume, without the JVM.
+# Relies on the ANTLR Python target lexers generated from src/main/antlr, with the tool and runtime versions of
+# build.gradle:
+#   pip install antlr4-python3-runtime==4.9.2
+#   antlr4 -v 4.9.2 -Dlanguage=Python3 -Xexact-output-dir -o antlr_generated \
+#       ../../antlr/Java8Lexer.g4 ../../antlr/CPP14Lexer.g4
+# Only grammars free of target-specific code generate as is: the Kotlin, Python3, JavaScript and C# lexers embed Java
+# actions or Java lexer base classes, which need porting before they can be generated for Python.
+# Token offsets are in code points, as those of the JVM lexers over CharStreams.fromString.
+GENERATED_PACKAGE: str = 'antlr_generated'
+PYTHON_TARGET_LEXERS: {str: str} = {
+    utils.JAVA_LANG_NAME: 'Java8Lexer',
+    utils.CPP_LANG_NAME: 'CPP14Lexer'
+}
+EOF_TOKEN_RULE: int = -1
+
+_lexer_classes = {}
+
+
+def lexer_class_of(lang_name: str):
+    if lang_name not in PYTHON_TARGET_LEXERS:
+        raise ValueError(f"No Python target lexer for '{lang_name}', available: {list(PYTHON_TARGET_LEXERS.keys())}.")
+    lexer_class = _lexer_classes.get(lang_name)
+    if lexer_class is None:
+        name = PYTHON_TARGET_LEXERS[lang_name]
+        lexer_class = getattr(importlib.import_module(f"{GENERATED_PACKAGE}.{name}"), name)
+        _lexer_classes[lang_name] = lexer_class
+    return lexer_class
+
+
+def lex(source: str, lang_name: str) -> ([int], [int], [int]):
+    # Token rule ids, start and (inclusive) stop offsets of every token of 'source', ending with the EOF token as the
+    # folds' token sequences do: type -1, starting past the last character and stopping before its start.
+    from antlr4 import InputStream
+    lexer = lexer_class_of(lang_name)(InputStream(source))
+    lexer.removeErrorListeners()
+    tokens = lexer.getAllTokens()
+    types, starts, stops = [t.type for t in tokens], [t.start for t in tokens], [t.stop for t in tokens]
+    types.append(EOF_TOKEN_RULE)
+    starts.append(len(source))
+    stops.append(len(source) - 1)
+    return types, starts, stops
+
+
+def parity(lang_name: str, fold_num: int = 0) -> dict:
+    # Checks the in-process lexer against the JVM one: the token rules of the fold's testing files, as lexed when the
+    # folds were generated, must be those lexed here from the same sources.
+    config = utils.Config(lang_name=lang_name)
+    jhetas = utils.load_json(config.get_jhetas_testing_path_of_fold(fold_num))
+    mismatches = []
+    for i, jh in enumerate(jhetas):
+        token_ids, starts, stops = lex(str(jh['source']['source']), lang_name)
+        expected = [(int(h['eta']['tokenRule']), int(h['eta']['startIndex']), int(h['eta']['stopIndex']))
+                    for h in jh['hetas']]
+        if list(zip(token_ids, starts, stops)) != expected:
+            mismatches.append(i)
+    return {
+        'lang_name': lang_name,
+        'fold': fold_num,
+        'files': len(jhetas),
+        'mismatches': len(mismatches),
+        'mismatched_files': mismatches[:20]
+    }
+
+
+if __name__ == '__main__':
+    if len(sys.argv) >= 3 and sys.argv[1] == 'parity':
+        print(parity(sys.argv[2], fold_num=int(sys.argv[3]) if len(sys.argv) >= 4 else 0))
+    else:
+        print(f"Unknown command sequence {sys.argv[1:]}")
@@ -0,0 +1,180 @@
+import queue
+import threading
+import time
+import torch
+#
+import inference as inference
+
+
+def predict_batch(model: torch.nn.Module, seqs: [torch.Tensor], device) -> [torch.Tensor]:
+    # Runs one right-padded forward over all 'seqs' (non negative token rules) and splits the per-token argmax
+    # hcodes back out, one tensor per input sequence, in input order.
+    lengths = torch.tensor([len(s) for s in seqs], dtype=torch.long)
+    padded = torch.nn.utils.rnn.pad_sequence(seqs, batch_first=True, padding_value=0)
+    ps = torch.argmax(model.forward_batch(padded.to(device), lengths.to(device)), dim=2).cpu()
+    return [ps[i, :n] for i, n in enumerate(lengths.tolist())]
+
+
+def predict_bucketed(model: torch.nn.Module, seqs, device, max_batch_tokens: int = 32_768, window_size: int = 256,
+                     max_chunk_tokens: int = 0):
+    # Yields the argmax hcodes of every sequence of the iterable 'seqs' (non negative token rules), in order.
+    # Sequences are consumed in windows of 'window_size': each window is sorted by length and cut into padded batches of
+    # at most 'max_batch_tokens' padded tokens, so that batches hold sequences of similar length and little padding.
+    # A positive 'max_chunk_tokens' caps the padded tokens of batches as well, keeping the memory bound of chunking.
+    if max_chunk_tokens > 0:
+        max_batch_tokens = min(max_batch_tokens, max_chunk_tokens)
+    window = []
+    for seq in seqs:
+        window.append(seq)
+        if len(window) == window_size:
+            yield from _predict_window(model, window, device, max_batch_tokens, max_chunk_tokens)
+            window = []
+    if window:
+        yield from _predict_window(model, window, device, max_batch_tokens, max_chunk_tokens)
+
+
+def _predict_window(model: torch.nn.Module, window: [torch.Tensor], device, max_batch_tokens: int,
+                    max_chunk_tokens: int) -> [torch.Tensor]:
+    ps = [None] * len(window)
+    batch = []
+
+    def flush():
+        for i, p in zip(batch, predict_batch(model, [window[i] for i in batch], device)):
+            ps[i] = p
+        batch.clear()
+
+    for i in sorted(range(len(window)), key=lambda j: len(window[j])):
+        n = len(window[i])
+        if n == 0:
+            ps[i] = window[i].new_zeros(0)
+        elif n > max_batch_tokens or not hasattr(model, 'forward_batch'):
+            ps[i] = inference.predict(model, window[i], device, max_chunk_tokens)
+        else:
+            # Lengths are ascending: 'n' is the longest of the batch.
+            if (len(batch) + 1) * n > max_batch_tokens:
+                flush()
+            batch.append(i)
+    if batch:
+        flush()
+    return ps
+
+
+class BatcherClosedError(RuntimeError):
+    # The batcher was closed (the model evicted or reconfigured) before serving the request.
+    pass
+
+
+class _PendingRequest:
+    def __init__(self, token_rules: torch.Tensor):
+        self.token_rules = token_rules
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class DynamicBatcher:
+    # Coalesces concurrent single-sequence requests into padded batches.
+    # A batch is closed as soon as 'max_wait_ms' have elapsed since its first request arrived, or when adding the
+    # next request would exceed 'max_batch_tokens' padded tokens (batch size * longest sequence).
+
+    def __init__(self, model: torch.nn.Module, device, max_wait_ms: float = 2.0, max_batch_tokens: int = 32_768,
+                 thread_policy=None):
+        self.model = model
+        self.device = device
+        # Input length -> intra-op threads policy, applied on the batching thread, which runs the forwards.
+        self.thread_policy = thread_policy
+        self.max_wait_s: float = max_wait_ms / 1000
+        self.max_batch_tokens: int = max_batch_tokens
+        #
+        self._queue = queue.Queue()
+        self._carry = None
+        self._is_closed: bool = False
+        # Orders requests against 'close': none is queued after the stop sentinel.
+        self._close_lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name='DynamicBatcher', daemon=True)
+        self._thread.start()
+
+    def predict(self, token_rules: torch.Tensor) -> torch.Tensor:
+        if len(token_rules) == 0:
+            # Would break a padded batch: answered here.
+            return token_rules.new_zeros(0).cpu()
+        pending = _PendingRequest(token_rules)
+        with self._close_lock:
+            if self._is_closed:
+                raise BatcherClosedError('Batcher is closed.')
+            self._queue.put(pending)
+        pending.done.wait()
+        if pending.error is not None:
+            raise pending.error
+        return pending.result
+
+    def queue_depth(self) -> int:
+        # Requests waiting for a batch, approximately.
+        return self._queue.qsize() + (1 if self._carry is not None else 0)
+
+    def close(self):
+        with self._close_lock:
+            if self._is_closed:
+                return
+            self._is_closed = True
+            self._queue.put(None)
+        self._thread.join()
+        # Fail whatever was still waiting to be served.
+        leftovers = [self._carry] if self._carry is not None else []
+        while not self._queue.empty():
+            leftovers.append(self._queue.get_nowait())
+        for pending in leftovers:
+            if pending is not None:
+                pending.error = BatcherClosedError('Batcher is closed.')
+                pending.done.set()
+
+    def _next_batch(self) -> [_PendingRequest]:
+        first = self._carry if self._carry is not None else self._queue.get()
+        self._carry = None
+        if first is None:
+            return None
+        #
+        batch = [first]
+        max_len = len(first.token_rules)
+        deadline = time.monotonic() + self.max_wait_s
+        while True:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                nxt = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if nxt is None:
+                # Serve what was collected, then stop.
+                self._queue.put(None)
+                break
+            nxt_max_len = max(max_len, len(nxt.token_rules))
+            if (len(batch) + 1) * nxt_max_len > self.max_batch_tokens:
+                self._carry = nxt
+                break
+            batch.append(nxt)
+            max_len = nxt_max_len
+        return batch
+
+    def _run(self):
+        with torch.no_grad():
+            while True:
+                batch = self._next_batch()
+                if batch is None:
+                    break
+                try:
+                    if self.thread_policy is not None:
+                        # Sized by the padded tokens of the batch.
+                        self.thread_policy.apply(len(batch) * max(len(p.token_rules) for p in batch))
+                    if len(batch) == 1 or not hasattr(self.model, 'forward_batch'):
+                        ps = [inference.predict(self.model, p.token_rules, self.device) for p in batch]
+                    else:
+                        ps = predict_batch(self.model, [p.token_rules for p in batch], self.device)
+                    for pending, p in zip(batch, ps):
+                        pending.result = p
+                except Exception as e:
+                    for pending in batch:
+                        pending.error = e
+                for pending in batch:
+                    pending.done.set()
@@ -0,0 +1,121 @@
+import os
+import sys
+import time
+import platform
+import torch
+#
+import utils as utils
+import inference as inference
+import metrics as metrics
+
+# Model-only inference benchmark, free of the transport costs of the http server.
+#   python benchmark.py <out_json> <threads>[,<threads>...] <model_log_path>[:<model_index>] [...]
+# Every model replays the test and snippets caches of the fold it was trained on, in cache order, once per thread
+# count, after WARMUP_INPUTS untimed forwards. Latency percentiles and throughput are reported per input length bucket
+# (see metrics.LENGTH_BUCKETS) and overall, along with the model family, language, task and environment, so that runs
+# on different models, machines or torch versions compare as plain json.
+WARMUP_INPUTS: int = 32
+SPLITS: [str] = ['testing', 'snippets']
+
+
+def _inputs_of(config: utils.Config, model_index: int, split: str) -> [torch.Tensor]:
+    if split == 'testing':
+        inputs, _ = config.get_cache_testing_of_fold(model_index)
+    elif split == 'snippets':
+        inputs, _ = config.get_cache_snippets_of_fold(model_index)
+    else:
+        raise ValueError(f"Unknown split '{split}', expected one of {SPLITS}.")
+    return inputs
+
+
+def _stats_of(latencies_ns: [int], num_tokens: int) -> dict:
+    latencies_ns = sorted(latencies_ns)
+    total_ns = sum(latencies_ns)
+    return {
+        'inputs': len(latencies_ns),
+        'tokens': num_tokens,
+        'tokens_per_s': num_tokens / (total_ns / 1e9) if total_ns > 0 else None,
+        'p50_ms': metrics.quantile_of(latencies_ns, 0.5) / 1e6,
+        'p95_ms': metrics.quantile_of(latencies_ns, 0.95) / 1e6,
+        'p99_ms': metrics.quantile_of(latencies_ns, 0.99) / 1e6
+    }
+
+
+def replay(model: torch.nn.Module, inputs: [torch.Tensor], device) -> dict:
+    with torch.no_grad():
+        for token_rules in inputs[:WARMUP_INPUTS]:
+            inference.predict(model, token_rules, device)
+        by_bucket = {}
+        for token_rules in inputs:
+            t0 = time.perf_counter_ns()
+            inference.predict(model, token_rules, device)
+            t1 = time.perf_counter_ns()
+            bucket = metrics.length_bucket_of(len(token_rules))
+            latencies, num_tokens = by_bucket.get(bucket, ([], 0))
+            latencies.append(t1 - t0)
+            by_bucket[bucket] = (latencies, num_tokens + len(token_rules))
+    all_latencies = [ns for latencies, _ in by_bucket.values() for ns in latencies]
+    return {
+        'overall': _stats_of(all_latencies, sum(n for _, n in by_bucket.values())),
+        'by_length_bucket': {bucket: _stats_of(latencies, num_tokens)
+                             for bucket, (latencies, num_tokens) in sorted(by_bucket.items(),
+                                                                           key=lambda b: float(b[0]))}
+    }
+
+
+def benchmark(log_path: str, model_index: int, threads: [int]) -> dict:
+    log = utils.load_json(log_path)
+    config = utils.Config()
+    config.apply_config_of(log['config'])
+    model = config.get_model_of_iter(model_index)
+    model.eval()
+
+    res = {
+        'model_log_name': os.path.basename(log_path).removesuffix('.json'),
+        'model_index': model_index,
+        'model_name': config.model_name,
+        'lang_name': config.lang_name,
+        'task_code': utils.task_code_of(config.task),
+        'config_name': config.config_name,
+        'device': str(config.device),
+        'runs': []
+    }
+    org_threads = torch.get_num_threads()
+    for num_threads in threads:
+        torch.set_num_threads(num_threads)
+        for split in SPLITS:
+            run = replay(model, _inputs_of(config, model_index, split), config.device)
+            res['runs'].append({'threads': num_threads, 'split': split, **run})
+            print(f"{res['model_log_name']} :: {model_index} | {num_threads} threads | {split} | "
+                  f"{run['overall']['tokens_per_s']:.0f} tokens/s, p50 {run['overall']['p50_ms']:.3f} ms")
+    torch.set_num_threads(org_threads)
+    return res
+
+
+def benchmark_all(model_names: [(str, int)], threads: [int]) -> dict:
+    return {
+        'environment': {
+            'torch': torch.__version__,
+            'python': platform.python_version(),
+            'machine': platform.machine(),
+            'num_cpus': os.cpu_count(),
+            'cuda': torch.cuda.get_device_name() if torch.cuda.is_available() else None,
+            'warmup_inputs': WARMUP_INPUTS
+        },
+        'models': [benchmark(log_path, model_index, threads) for log_path, model_index in model_names]
+    }
+
+
+def _model_name_of(arg: str) -> (str, int):
+    if ':' in arg:
+        log_path, model_index = arg.rsplit(':', 1)
+        return log_path, int(model_index)
+    return arg, 0
+
+
+if __name__ == '__main__':
+    if len(sys.argv) >= 4:
+        utils.dump_json(sys.argv[1], benchmark_all([_model_name_of(arg) for arg in sys.argv[3:]],
+                                                   [int(t) for t in sys.argv[2].split(',')]))
+    else:
+        print(f"Unknown command sequence {sys.argv[1:]}")
@@ -19,6 +19,8 @@ class CNNClassifier1(torch.nn.Module):
         self.cnn = torch.nn.Sequential(*self.cnn_list)
         self.conv3 = torch.nn.Conv1d(hidden_dim * 2, 256, 5, padding=2)
         self.fc = torch.nn.Linear(256, num_classes)
+        # Number of neighbouring tokens, on each side, that can influence the prediction of a token.
+        self.receptive_radius: int = max(padding, padding2) + num_layers * padding + 2
 
     def forward(self, x):
         x = self.emb(x)
@@ -45,3 +47,74 @@ class CNNClassifier1(torch.nn.Module):
             out = x_logit.squeeze(0)
 
         return out
+
+    def forward_batch(self, x, lengths):
+        # x: (batch, max_len) right-padded token ids, lengths: (batch,) true lengths.
+        # Padded positions are zeroed before every convolution so that each sequence sees exactly the zero padding
+        # it would have seen if evaluated on its own through 'forward'.
+        mask = (torch.arange(x.shape[1], device=x.device).unsqueeze(0) < lengths.unsqueeze(1)).unsqueeze(1)
+        x = self.emb(x)
+        x = self.dropout(x).transpose(1, 2) * mask
+        x = torch.nn.functional.relu(torch.cat((self.conv1(x), self.conv2(x)), dim=1))
+        x = self.dropout(x)
+        for cnn_layer in self.cnn_list:
+            x = torch.nn.functional.relu(cnn_layer(x * mask))
+            x = self.dropout(x)
+
+        x = torch.nn.functional.relu(self.conv3(x * mask))
+        x = x.transpose(1, 2)
+        out = self.fc(x)
+
+        if not self.training:
+            out = torch.nn.functional.log_softmax(out, dim=2)
+
+        return out
+
+
+def incremental_predict(model: torch.nn.Module, prev_token_rules: torch.Tensor, prev_ps: torch.Tensor, offset: int,
+                        removed: int, inserted: torch.Tensor) -> (torch.Tensor, torch.Tensor, int, torch.Tensor):
+    # Applies the edit (replace 'removed' tokens at 'offset' with 'inserted') to a previously evaluated sequence and
+    # only recomputes the predictions within the model's receptive field of the edit.
+    # Returns the new token rules, the new hcodes, and the start index and hcodes of the recomputed span: every hcode
+    # outside of it is the previous one, shifted by the edit.
+    if len(prev_ps) != len(prev_token_rules):
+        raise ValueError(f"Got {len(prev_ps)} previous hcodes for {len(prev_token_rules)} tokens.")
+    if not (0 <= offset <= len(prev_token_rules) and 0 <= removed <= len(prev_token_rules) - offset):
+        raise ValueError(f"Invalid edit at offset {offset} removing {removed} of {len(prev_token_rules)} tokens.")
+    r = model.receptive_radius
+    token_rules = torch.cat((prev_token_rules[:offset], inserted, prev_token_rules[offset + removed:]))
+    n = len(token_rules)
+    # Span of predictions whose receptive field overlaps the edit.
+    start = max(0, offset - r)
+    stop = min(n, offset + len(inserted) + r)
+    if n == 0:
+        return token_rules, prev_ps[:0], 0, prev_ps[:0]
+    # Input window: the span plus its full context, so that no artificial padding reaches the span.
+    window_start = max(0, start - r)
+    window_stop = min(n, stop + r)
+    device = next(model.parameters()).device
+    window = token_rules[window_start:window_stop].to(device)
+    span_ps = torch.argmax(model(window), dim=1)[start - window_start:stop - window_start].cpu()
+    #
+    shift = len(inserted) - removed
+    ps = torch.cat((prev_ps[:start], span_ps, prev_ps[stop - shift:]))
+    return token_rules, ps, start, span_ps
+
+
+def chunked_predict(model: torch.nn.Module, token_rules: torch.Tensor, max_chunk_tokens: int) -> torch.Tensor:
+    # Evaluates 'token_rules' through overlapping windows of at most 'max_chunk_tokens' tokens: each window carries the
+    # model's receptive field of context on both sides, hence the stitched hcodes equal those of a single forward.
+    r = model.receptive_radius
+    step = max_chunk_tokens - 2 * r
+    if step <= 0:
+        raise ValueError(f"A chunk of {max_chunk_tokens} tokens cannot hold the receptive field of {2 * r + 1} tokens.")
+    n = len(token_rules)
+    device = next(model.parameters()).device
+    chunks_ps = []
+    for start in range(0, n, step):
+        stop = min(n, start + step)
+        window_start = max(0, start - r)
+        window_stop = min(n, stop + r)
+        window = token_rules[window_start:window_stop].to(device)
+        chunks_ps.append(torch.argmax(model(window), dim=1)[start - window_start:stop - window_start].cpu())
+    return torch.cat(chunks_ps) if chunks_ps else token_rules[:0].cpu()
@@ -13,7 +13,11 @@ def acc_of(model: torch.nn.Module, seq_in: torch.Tensor, seq_t: torch.Tensor, lo
 
 
 def acc_of_all(model: torch.nn.Module, seqs_in: [torch.Tensor], seqs_t: [torch.Tensor], loss_function, msg: str = 'Eval') -> (float, {(int, int): int}, [int], [int], [torch.Tensor]):
-    N = len(seqs_in)
+    return acc_of_pairs(model, zip(seqs_in, seqs_t), len(seqs_in), loss_function, msg=msg)
+
+
+def acc_of_pairs(model: torch.nn.Module, pairs, N: int, loss_function, msg: str = 'Eval') -> (float, {(int, int): int}, [int], [int], [torch.Tensor]):
+    # As 'acc_of_all', over any iterable of N (input, target) pairs, e.g. a data loader.
     #
     accs_sum = 0
     errs_sum = 0
@@ -25,7 +29,7 @@ def acc_of_all(model: torch.nn.Module, seqs_in: [torch.Tensor], seqs_t: [torch.T
     #
     seqs_p = []
     #
-    for i, (seq_in, seq_t) in enumerate(zip(seqs_in, seqs_t)):
+    for i, (seq_in, seq_t) in enumerate(pairs):
         (acc_sc, errs, seq_p, loss) = acc_of(model, seq_in, seq_t, loss_function)
         #
         accs_sum += acc_sc
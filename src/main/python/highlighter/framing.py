@@ -0,0 +1,101 @@
+import os
+import select
+import struct
+import time
+import torch
+#
+import batcher as batcher
+import inference as inference
+import wire as wire
+
+# Length-prefixed binary protocol of 'main.py useframed', all little-endian.
+#   Request frame:  [request id u32][n i32][n token ids i32]; n = -1 ends the session, any other negative n is an
+#                   error ending it too.
+#   Response frame: [request id u32][ns i64][n u32][n hcodes i16].
+# Callers may keep many requests in flight: whatever is pending on stdin when the server is ready is evaluated as one
+# length-bucketed batch, and responses are written as they complete, hence possibly out of request order.
+_REQUEST_HEADER = struct.Struct('<Ii')
+_RESPONSE_HEADER = struct.Struct('<IqI')
+_READ_SIZE: int = 1 << 16
+# Sequences per bucketed window: responses of a window are written as soon as it completes.
+_RESPONSE_WINDOW: int = 32
+END_OF_SESSION: int = -1
+
+
+class FrameReader:
+    def __init__(self, fd: int):
+        self.fd: int = fd
+        self.is_eof: bool = False
+        self._buf = bytearray()
+
+    def _fill(self, block: bool) -> bool:
+        if not block and not select.select([self.fd], [], [], 0)[0]:
+            return False
+        data = os.read(self.fd, _READ_SIZE)
+        if not data:
+            self.is_eof = True
+            return False
+        self._buf += data
+        return True
+
+    def _parse(self, max_frames: int) -> [(int, bytes)]:
+        # Complete frames at the head of the buffer, as (request id, token ids bytes or None for the end of session).
+        frames = []
+        while len(frames) < max_frames and len(self._buf) >= _REQUEST_HEADER.size:
+            request_id, n = _REQUEST_HEADER.unpack_from(self._buf)
+            if n == END_OF_SESSION:
+                del self._buf[:_REQUEST_HEADER.size]
+                frames.append((request_id, None))
+                break
+            if n < 0:
+                # The stream can not be resynchronised past a corrupt header: end the session.
+                raise ValueError(f"Invalid token count {n} in the frame of request {request_id}.")
+            stop = _REQUEST_HEADER.size + 4 * n
+            if len(self._buf) < stop:
+                break
+            frames.append((request_id, bytes(self._buf[_REQUEST_HEADER.size:stop])))
+            del self._buf[:stop]
+        return frames
+
+    def read_frames(self, max_frames: int) -> [(int, bytes)]:
+        # Blocks until at least a frame is available, then also takes every complete frame already pending.
+        frames = self._parse(max_frames)
+        while not frames and not self.is_eof:
+            self._fill(block=True)
+            frames = self._parse(max_frames)
+        while 0 < len(frames) < max_frames and frames[-1][1] is not None and self._fill(block=False):
+            frames += self._parse(max_frames - len(frames))
+        return frames
+
+
+def write_response(outfile, request_id: int, ns: int, ps: torch.Tensor):
+    outfile.write(_RESPONSE_HEADER.pack(request_id, ns, len(ps)))
+    outfile.write(wire.encode_hcodes(ps))
+
+
+def serve(model: torch.nn.Module, device, infile_fd: int, outfile, max_pending: int = 256,
+          max_batch_tokens: int = 32_768, max_chunk_tokens: int = 0):
+    reader = FrameReader(infile_fd)
+    with torch.no_grad():
+        while True:
+            frames = reader.read_frames(max_pending)
+            is_end = len(frames) == 0 or frames[-1][1] is None
+            frames = [f for f in frames if f[1] is not None]
+            if len(frames) > 0:
+                t0 = time.time_ns()
+                # Create non negative inputs.
+                seqs = [wire.decode_token_rules(body) for _, body in frames]
+                if len(frames) == 1 and len(seqs[0]) > 0:
+                    ps = [inference.predict(model, seqs[0], device, max_chunk_tokens)]
+                    order = [0]
+                else:
+                    # Shortest first: their responses need not wait for the longest inputs' batches.
+                    order = sorted(range(len(frames)), key=lambda i: len(seqs[i]))
+                    ps = batcher.predict_bucketed(model, [seqs[i] for i in order], device,
+                                                  max_batch_tokens=max_batch_tokens, window_size=_RESPONSE_WINDOW,
+                                                  max_chunk_tokens=max_chunk_tokens)
+                for i, p in zip(order, ps):
+                    write_response(outfile, frames[i][0], time.time_ns() - t0, p)
+                    outfile.flush()
+            if is_end:
+                break
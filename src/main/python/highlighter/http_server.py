@@ -1,79 +1,410 @@
-from flask import Flask, request
+from flask import Flask, request, Response
 import torch
 import time
+import json
+import atexit
+import threading
 #
-from pygments import highlight
 from pygments.lexers import Python3Lexer, JavaLexer, KotlinLexer, JavascriptLexer, CSharpLexer, CppLexer
 #
 import utils as utils
 import pygments_utils as pygments_utils
+import registry as registry
+import cnn as cnn
+import inference as inference
+import batcher as batcher
+import wire as wire
+import prediction_cache as prediction_cache
+import thread_policy as thread_policy
+import metrics as metrics
+import profiling as profiling
+import warmup as warmup
+import spans as spans
+import antlr_lexing as antlr_lexing
 
 
 app = Flask(__name__)
 
 # Model's
-device = None
-model = None
+# Every loaded model lives in the registry; requests not naming a model use the one last loaded via /load_model.
+model_registry = registry.ModelRegistry()
+default_model_name = None
+# Serving options of the models loaded via /load_model, by model name (log name, index, is scripted, quantization):
+# applied again when a model evicted from the registry is loaded back on demand.
+model_options: {(str, int, bool, str): dict} = {}
+_options_lock = threading.Lock()
+# Whether the default model can serve at steady state speed: see /ready. The server is not ready while any load is
+# in progress.
+is_ready = False
+_loads_in_progress = 0
+_readiness_lock = threading.Lock()
+# Optional cache of predictions, shared by all models: see /load_model.
+model_prediction_cache = None
+atexit.register(lambda: _replace_prediction_cache(None))
+
+# Per stage latencies of /eval_model, and gauges evaluated at scrape time: see /metrics.
+server_metrics = metrics.Metrics()
+server_metrics.register(
+    'highlighter_batcher_queue_depth', 'Requests waiting for a batch of the model\'s dynamic batcher.', 'gauge',
+    lambda: _batcher_queue_depths())
+server_metrics.register(
+    'highlighter_prediction_cache_hits_total', 'Prediction cache hits of this process.', 'counter',
+    lambda: [({}, model_prediction_cache.stats()['hits'])] if model_prediction_cache is not None else [])
+server_metrics.register(
+    'highlighter_prediction_cache_misses_total', 'Prediction cache misses of this process.', 'counter',
+    lambda: [({}, model_prediction_cache.stats()['misses'])] if model_prediction_cache is not None else [])
+
+# Armed through /profile or the 'X-Profile-Forwards' header of /eval_model.
+forward_profiler = profiling.ForwardProfiler()
 
 # Pygments'
 lang_lexer = None
-drop_formatter = pygments_utils.DropFormatter()
 json_formatter = None
 
 
+def _batcher_queue_depths() -> [(dict, int)]:
+    depths = []
+    for entry in model_registry.entries():
+        # Read once: the batcher may be swapped or closed meanwhile.
+        entry_batcher = entry.batcher
+        if entry_batcher is not None:
+            depths.append(({'model': entry.name}, entry_batcher.queue_depth()))
+    return depths
+
+
+@app.errorhandler(ValueError)
+def bad_request(e: ValueError):
+    # Invalid requests (unknown models, modes or dtypes, unsupported combinations) are the client's error.
+    return str(e), 400
+
+
+def _requested_model(is_binary: bool) -> registry.RegisteredModel:
+    # Binary requests name their model through headers, JSON ones through the body.
+    if is_binary:
+        model_log_name = request.headers.get("X-Model-Log-Name")
+        model_index = int(request.headers.get("X-Model-Index", 0))
+        is_scripted = request.headers.get("X-Model-Scripted", "false") == "true"
+        quantization = request.headers.get("X-Model-Quantization")
+    else:
+        model_log_name = request.json.get("model_log_name")
+        model_index = request.json.get("model_index", 0)
+        is_scripted = request.json.get("is_scripted", False)
+        quantization = request.json.get("quantization")
+    if model_log_name is None:
+        if default_model_name is None:
+            raise ValueError('No model was loaded and none was named in the request.')
+        model_log_name, model_index, is_scripted, quantization = default_model_name
+    return configured_model((model_log_name, model_index, is_scripted, quantization))
+
+
+def configured_model(name: (str, int, bool, str)) -> registry.RegisteredModel:
+    # The registered model, (re)loaded if needed, set up with the serving options it was last loaded with.
+    model_log_name, model_index, is_scripted, quantization = name
+    entry = model_registry.load(model_log_name, model_index, is_scripted=is_scripted, quantization=quantization)
+    options = model_options.get(name)
+    if options is not None and entry.load_options is not options:
+        with _options_lock:
+            if entry.load_options is not options:
+                _configure(entry, name, options)
+    return entry
+
+
+def _configure(entry: registry.RegisteredModel, name: (str, int, bool, str), options: dict):
+    model_log_name, model_index, _, _ = name
+    if options["tune_threads"] and entry.thread_policy is None:
+        entry.thread_policy = thread_policy.thread_policy_of(entry.model, entry.device, model_log_name, model_index,
+                                                             variant=entry.variant)
+    max_batch_tokens = options["batch_max_tokens"]
+    if options["max_chunk_tokens"] > 0:
+        # Batches would otherwise exceed the memory bound of chunking.
+        max_batch_tokens = min(max_batch_tokens, options["max_chunk_tokens"])
+    entry.enable_batching(options["batch_max_wait_ms"], max_batch_tokens)
+    entry.max_chunk_tokens = options["max_chunk_tokens"]
+    entry.load_options = options
+
+
 @app.post("/load_model")
 def load_model():
-    global device
-    global model
+    global is_ready
+    global _loads_in_progress
+
+    with _readiness_lock:
+        _loads_in_progress += 1
+        is_ready = False
+    try:
+        return _load_model()
+    finally:
+        with _readiness_lock:
+            _loads_in_progress -= 1
+            # A failed load leaves the previous default model serving.
+            is_ready = _loads_in_progress == 0 and default_model_name is not None
+
+
+def _replace_prediction_cache(cache):
+    global model_prediction_cache
+
+    old, model_prediction_cache = model_prediction_cache, cache
+    # Releases a shared table's segment and lock file, once the requests using it are done with it.
+    if isinstance(old, prediction_cache.SharedPredictionCache):
+        old.close()
+
+
+def model_options_of(values: dict) -> dict:
+    # Serving options of a model, from the values of a /load_model request (or the pre-forking server's arguments).
+    return {
+        # Batching window: 0 disables batching (one forward per request).
+        "batch_max_wait_ms": values.get("batch_max_wait_ms", 0),
+        "batch_max_tokens": values.get("batch_max_tokens", 32_768),
+        # Inputs longer than this are evaluated in bounded-memory chunks, and batches are capped to it: 0 disables
+        # chunking.
+        "max_chunk_tokens": values.get("max_chunk_tokens", 0),
+        # Sets torch's intra-op threads per input length, from a policy calibrated once per model and machine.
+        "tune_threads": values.get("tune_threads", False)
+    }
 
-    model_log_name: str = request.json["model_log_name"]
-    model_index: int = request.json["model_index"]
 
-    # Load config of trained model.
-    log = utils.load_json(f"../saved_model_losses/{model_log_name}.json")
+def configure_prediction_cache(values: dict):
+    # Prediction cache: an in-process LRU of 'prediction_cache_bytes' bytes (0 disables it), or the shared memory
+    # table named 'prediction_cache_shm', created by the first process loading it and attached to by the others.
+    if "prediction_cache_shm" in values:
+        if not isinstance(model_prediction_cache, prediction_cache.SharedPredictionCache):
+            _replace_prediction_cache(
+                prediction_cache.SharedPredictionCache.open_or_create(values["prediction_cache_shm"]))
+    elif "prediction_cache_bytes" in values:
+        cache_bytes = int(values["prediction_cache_bytes"])
+        _replace_prediction_cache(prediction_cache.PredictionCache(cache_bytes) if cache_bytes > 0 else None)
 
-    # Rebuild original config
-    config = utils.Config()
-    config.apply_config_of(log['config'])
 
-    device = config.device
+def _load_model():
+    global default_model_name
 
-    # Retrieve the last trained model.
-    model = config.get_model_of_iter(model_index)
-    model.eval()
+    model_log_name: str = request.json["model_log_name"]
+    model_index: int = request.json["model_index"]
+    # Loads the frozen TorchScript artifact exported by 'scripted.py export' instead of the eager model.
+    is_scripted: bool = request.json.get("is_scripted", False)
+    # Int8 quantized CPU inference, 'dynamic' or 'static' (see quantize.py): None keeps the float model.
+    quantization: str = request.json.get("quantization")
+    options = model_options_of(request.json)
+    # Runs forwards of representative lengths until the model reaches steady state speed (see warmup.py), before
+    # answering and becoming ready.
+    warm_up: bool = request.json.get("warm_up", False)
+    # Memory budget of the registry, in bytes of model weights.
+    if "registry_max_bytes" in request.json:
+        model_registry.max_bytes = int(request.json["registry_max_bytes"])
+    configure_prediction_cache(request.json)
+
+    name = (model_log_name, model_index, is_scripted, quantization)
+    inference.check_max_chunk_tokens(
+        model_registry.load(model_log_name, model_index, is_scripted=is_scripted, quantization=quantization).model,
+        options["max_chunk_tokens"])
+    model_options[name] = options
+    entry = configured_model(name)
+    default_model_name = name
+    res = "loaded"
+    if warm_up:
+        warmup_ns, warmup_rounds = warmup.warm_up(entry)
+        res = {"status": "loaded", "warmup_ns": warmup_ns, "warmup_rounds": warmup_rounds}
 
     # print(f"| Loaded {model_log_name} :: {model_index}")
 
-    return "loaded"
+    return res
 
 
 @app.post("/eval_model")
 def eval_model():
     with torch.no_grad():
-        global device
-        global model
-
-        input_token_ids: list[int] = request.json["input_token_ids"]
-        # print(f"> ({time.time()}) new input len: '{len(input_token_ids)}'")
+        timer = metrics.StageTimer()
+        if "X-Profile-Forwards" in request.headers:
+            forward_profiler.arm(int(request.headers["X-Profile-Forwards"]), request.headers.get("X-Profile-Sub-Dir"))
+        is_binary = request.mimetype == wire.BINARY_CONTENT_TYPE
+        if not is_binary:
+            # Parses the body now, as part of decoding: the model lookup reads it.
+            request.get_json()
+        # Looking the model up may load it: that is no stage of the request.
+        with timer.excluded():
+            entry = _requested_model(is_binary)
 
-        # Create non negative input.
-        token_rules = list(map(lambda x: int(x) + 1, input_token_ids))
+        if is_binary:
+            body = request.get_data()
+            token_dtype = request.headers.get(wire.TOKEN_DTYPE_HEADER, 'int32')
+            try:
+                wire.check_body(body, token_dtype)
+            except ValueError as e:
+                return str(e), 400
+            timer.lap(metrics.STAGE_DECODE)
+        else:
+            token_starts, token_stops = request.json.get("token_starts"), request.json.get("token_stops")
+            if "source" in request.json:
+                # Raw source code, lexed in-process (see antlr_lexing.py); answered with spans if 'spans' is set.
+                timer.lap(metrics.STAGE_DECODE)
+                input_token_ids, starts, stops = antlr_lexing.lex(request.json["source"], entry.key[0])
+                if request.json.get("spans", False):
+                    token_starts, token_stops = starts, stops
+                timer.lap(metrics.STAGE_LEX)
+            else:
+                input_token_ids: list[int] = request.json["input_token_ids"]
+                if token_starts is not None and \
+                        not len(token_starts) == len(token_stops or []) == len(input_token_ids):
+                    return "'token_starts' and 'token_stops' must hold one offset per input token.", 400
+                timer.lap(metrics.STAGE_DECODE)
+            # print(f"> ({time.time()}) new input len: '{len(input_token_ids)}'")
         #
         t0 = time.time_ns()
-        tens_token_rules = torch.tensor(token_rules, dtype=torch.long).to(device)
-        ps = torch.argmax(model(tens_token_rules), dim=1)
+        ps = None
+        cache = model_prediction_cache
+        if cache is not None:
+            token_ids_bytes = wire.canonical_token_ids_bytes(body, token_dtype) if is_binary \
+                else prediction_cache.token_ids_bytes_of(input_token_ids)
+            digest = prediction_cache.digest_of(entry.key, token_ids_bytes)
+            ps = cache.get(digest)
+            timer.lap(metrics.STAGE_CACHE_LOOKUP)
+        if ps is None:
+            # Create non negative input.
+            if is_binary:
+                token_rules = wire.decode_token_rules(body, token_dtype)
+            else:
+                token_rules = list(map(lambda x: int(x) + 1, input_token_ids))
+            tens_token_rules = torch.as_tensor(token_rules, dtype=torch.long)
+            timer.lap(metrics.STAGE_TENSOR_BUILD)
+            with forward_profiler.capture(f"{entry.name.replace('/', '-')}_{len(tens_token_rules)}") as is_profiled:
+                # Read once: an eviction or a reconfiguration may swap or close it meanwhile.
+                entry_batcher = entry.batcher
+                # Profiled forwards run on this thread, where the profiler records them, rather than the batcher's.
+                if entry_batcher is not None and not is_profiled \
+                        and not 0 < entry.max_chunk_tokens < len(tens_token_rules):
+                    try:
+                        # Includes the time spent waiting for the batch to fill.
+                        ps = entry_batcher.predict(tens_token_rules)
+                        timer.lap(metrics.STAGE_FORWARD)
+                    except batcher.BatcherClosedError:
+                        # Served directly instead.
+                        pass
+                if ps is None:
+                    if entry.thread_policy is not None:
+                        entry.thread_policy.apply(len(tens_token_rules))
+                    ps = inference.predict(entry.model, tens_token_rules, entry.device, entry.max_chunk_tokens,
+                                           timer=timer)
+            if cache is not None:
+                cache.put(digest, ps)
         t1 = time.time_ns()
         #
         model_cmp_time_ns = round(t1 - t0)
 
         # print(f"< completed in ns: {model_cmp_time_ns}")
 
+        if is_binary:
+            response = Response(wire.encode_hcodes(ps), mimetype=wire.BINARY_CONTENT_TYPE,
+                                headers={wire.NS_HEADER: str(model_cmp_time_ns)})
+        elif token_starts is not None:
+            # Character spans of generic hcodes, given the tokens' character offsets: see spans.py.
+            span_starts, span_stops, span_hcodes = spans.char_spans_of(
+                ps, entry.task_decoder, torch.as_tensor(token_starts, dtype=torch.long),
+                torch.as_tensor(token_stops, dtype=torch.long))
+            response = {
+                "ns": model_cmp_time_ns,
+                "spans": spans.flat_spans_of(span_starts, span_stops, span_hcodes)
+            }
+        else:
+            response = {
+                "ns": model_cmp_time_ns,
+                "ps": [thc.item() for thc in ps]
+            }
+        timer.lap(metrics.STAGE_ENCODE)
+        server_metrics.observe(entry.name, len(ps), timer)
+        return response
+
+
+@app.post("/eval_model_batch")
+def eval_model_batch():
+    # Highlights many token sequences ('inputs') at once through length-bucketed padded batches, streaming back one
+    # JSON line {"i": index, "ps": hcodes} per sequence, in request order.
+    entry = _requested_model(False)
+    inputs: list[list[int]] = request.json["inputs"]
+    max_batch_tokens: int = request.json.get("max_batch_tokens", 32_768)
+    cache = model_prediction_cache
+
+    digests = [None] * len(inputs)
+    cached_ps = [None] * len(inputs)
+    if cache is not None:
+        for i, input_token_ids in enumerate(inputs):
+            digests[i] = prediction_cache.digest_of(entry.key, prediction_cache.token_ids_bytes_of(input_token_ids))
+            cached_ps[i] = cache.get(digests[i])
+
+    def results():
+        with torch.no_grad():
+            # Create non negative inputs of the cache misses.
+            misses = (torch.tensor(input_token_ids, dtype=torch.long) + 1
+                      for input_token_ids, ps in zip(inputs, cached_ps) if ps is None)
+            misses_ps = batcher.predict_bucketed(entry.model, misses, entry.device, max_batch_tokens=max_batch_tokens,
+                                                 max_chunk_tokens=entry.max_chunk_tokens)
+            for i, ps in enumerate(cached_ps):
+                if ps is None:
+                    ps = next(misses_ps)
+                    if cache is not None:
+                        cache.put(digests[i], ps)
+                yield json.dumps({"i": i, "ps": ps.tolist()}) + "\n"
+
+    return Response(results(), mimetype="application/x-ndjson")
+
+
+@app.post("/eval_model_incremental")
+def eval_model_incremental():
+    # Re-highlights a previously evaluated sequence after an edit, only recomputing the predictions within the
+    # model's receptive field of the edit; answers with the start index and hcodes of the recomputed span.
+    with torch.no_grad():
+        entry = _requested_model(False)
+        if not hasattr(entry.model, 'receptive_radius'):
+            raise ValueError(f"Incremental evaluation requires a {utils.CNNClassifier1}.")
+
+        prev_token_rules = torch.tensor(request.json["prev_input_token_ids"], dtype=torch.long) + 1
+        prev_ps = torch.tensor(request.json["prev_ps"], dtype=torch.long)
+        inserted = torch.tensor(request.json["inserted_token_ids"], dtype=torch.long) + 1
+        #
+        t0 = time.time_ns()
+        _, _, start, span_ps = cnn.incremental_predict(
+            entry.model, prev_token_rules, prev_ps, request.json["offset"], request.json["removed"], inserted)
+        t1 = time.time_ns()
+
         return {
-            "ns": model_cmp_time_ns,
-            "ps": [thc.item() for thc in ps]
+            "ns": t1 - t0,
+            "start": start,
+            "ps": span_ps.tolist()
         }
 
 
+@app.get("/prediction_cache")
+def prediction_cache_stats():
+    return model_prediction_cache.stats() if model_prediction_cache is not None else {}
+
+
+@app.post("/profile")
+def profile_forwards():
+    # Profiles the next 'num_forwards' forwards of /eval_model (0 disarms), writing to the profiles directory or its
+    # subdirectory 'sub_dir'.
+    forward_profiler.arm(int(request.json["num_forwards"]), request.json.get("sub_dir"))
+    return "armed"
+
+
+@app.get("/metrics")
+def metrics_text():
+    # Prometheus text exposition format, of this process only (each pre-forked worker answers for itself).
+    return Response(server_metrics.render(), mimetype="text/plain; version=0.0.4")
+
+
+@app.get("/ready")
+def ready():
+    return ("ready", 200) if is_ready else ("not ready", 503)
+
+
+@app.get("/models")
+def loaded_models():
+    return {
+        "max_bytes": model_registry.max_bytes,
+        "total_bytes": model_registry.total_bytes(),
+        "models": [list(k) for k in model_registry.keys()]
+    }
+
+
 @app.post("/load_pygments")
 def load_pygments():
     global lang_lexer
@@ -109,18 +440,19 @@ def load_pygments():
 @app.post("/eval_pygments")
 def eval_pygments():
     global lang_lexer
-    global drop_formatter
     global json_formatter
 
     src = request.json["src"]
 
-    t0 = time.time_ns()
-    highlight(src, lang_lexer, drop_formatter)
-    t1 = time.time_ns()
-
-    res_json = highlight(src, lang_lexer, json_formatter)
+    lex_ns, res_json = pygments_utils.lex_and_format(src, lang_lexer, json_formatter)
 
     return {
-        "ns": t1 - t0,
+        "ns": lex_ns,
         "res_json": res_json
     }
+
+
+@app.get("/pygments_unknown")
+def pygments_unknown():
+    # Occurrences of the pygments token types missing from the loaded bindings, resolved through their parents.
+    return json_formatter.bindings_table.unknown_counts if json_formatter is not None else {}
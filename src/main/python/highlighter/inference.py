@@ -0,0 +1,58 @@
+import torch
+#
+import cnn as cnn
+import metrics as metrics
+
+
+def is_chunkable(model: torch.nn.Module) -> bool:
+    # CNNs through their finite receptive field, unidirectional recurrent models by carrying their hidden state over.
+    return hasattr(model, 'receptive_radius') or \
+        (hasattr(model, 'forward_with_state') and not model.is_bidirectional)
+
+
+def check_max_chunk_tokens(model: torch.nn.Module, max_chunk_tokens: int):
+    # To be checked once, when serving starts, rather than failing every long input: a CNN's chunk must hold its
+    # receptive field.
+    if max_chunk_tokens > 0 and hasattr(model, 'receptive_radius') and max_chunk_tokens <= 2 * model.receptive_radius:
+        raise ValueError(f"A chunk of {max_chunk_tokens} tokens cannot hold the receptive field of "
+                         f"{2 * model.receptive_radius + 1} tokens.")
+
+
+def predict(model: torch.nn.Module, token_rules: torch.Tensor, device, max_chunk_tokens: int = 0,
+            timer: metrics.StageTimer = metrics.NULL_STAGE_TIMER) -> torch.Tensor:
+    # Returns the argmax hcodes of the non negative 'token_rules', on the cpu.
+    # With a positive 'max_chunk_tokens', longer inputs of chunkable models are evaluated chunk by chunk, bounding
+    # peak activation memory by the chunk size rather than by the input length; the hcodes are unchanged. Batched paths
+    # bound their padded batches by the chunk size too (see batcher.py and http_server's /load_model).
+    # 'timer' laps the device transfer, forward and argmax stages where they are separate, else the forward only.
+    # Stages are not synchronised with cuda: asynchronous kernels are accounted to the stage that waits on them.
+    if len(token_rules) == 0:
+        # Nothing to highlight, and no forward accepts an empty input.
+        return token_rules.new_zeros(0).cpu()
+    if isinstance(model, torch.jit.ScriptModule):
+        # Exported artifacts already answer with hcodes.
+        x = token_rules.to(device)
+        timer.lap(metrics.STAGE_DEVICE_TRANSFER)
+        ps = model(x).cpu()
+        timer.lap(metrics.STAGE_FORWARD)
+        return ps
+    if max_chunk_tokens <= 0 or len(token_rules) <= max_chunk_tokens or not is_chunkable(model):
+        x = token_rules.to(device)
+        timer.lap(metrics.STAGE_DEVICE_TRANSFER)
+        out = model(x)
+        timer.lap(metrics.STAGE_FORWARD)
+        ps = torch.argmax(out, dim=1).cpu()
+        timer.lap(metrics.STAGE_ARGMAX)
+        return ps
+    if hasattr(model, 'receptive_radius'):
+        ps = cnn.chunked_predict(model, token_rules, max_chunk_tokens)
+        timer.lap(metrics.STAGE_FORWARD)
+        return ps
+    #
+    hidden = None
+    chunks_ps = []
+    for start in range(0, len(token_rules), max_chunk_tokens):
+        out, hidden = model.forward_with_state(token_rules[start:start + max_chunk_tokens].to(device), hidden)
+        chunks_ps.append(torch.argmax(out, dim=1).cpu())
+    timer.lap(metrics.STAGE_FORWARD)
+    return torch.cat(chunks_ps)
@@ -5,15 +5,20 @@ import torch
 import time
 import os.path
 #
-from pygments import highlight
 from pygments.lexers import Python3Lexer, JavaLexer, KotlinLexer, JavascriptLexer, CSharpLexer, CppLexer
 #
 import utils as utils
-import trainer as trainer
 import pygments_utils as pygments_utils
+import inference as inference
+import quantize as quantize
+import batcher as batcher
+import framing as framing
+import thread_policy as thread_policy
+import profiling as profiling
+import sweep as sweep
 
 
-def training_seq():
+def training_seq(num_workers: int = 1, threads_per_worker: int = None):
 
     all_configs = list(itertools.product(
         # lang_names:
@@ -35,14 +40,11 @@ def training_seq():
         # dropout
         [0.2]#, 0.3, 0.5]
     ))
-    tot_num_configs = len(all_configs)
-
-    for i, config in enumerate(all_configs):
-        print('On config', (i + 1), 'of', tot_num_configs)
-        print(config)
 
+    configs_kwargs = []
+    for config in all_configs:
         lang_name, task, model_name, embs_dim, hidden_dim, hidden_layers, is_bid, kernel_size, dropout = config
-        config = utils.Config(
+        configs_kwargs.append(dict(
             lang_name=lang_name,
             run_code=1,
             #
@@ -60,15 +62,13 @@ def training_seq():
             is_save_module_to_path=True,
             kernel_size=kernel_size,
             dropout=dropout
-        )
-        print(f"Using device {config.device}")
-        if not os.path.isfile(config.session_loss_evo_path):
-            trainer.debug_training(config)
-        else:
-            print('Configuration already carried out:', config.session_loss_evo_path)
+        ))
+    # Configurations already carried out are skipped, interrupted ones are resumed: see sweep.py.
+    sweep.run(configs_kwargs, num_workers=num_workers, threads_per_worker=threads_per_worker)
 
 
-def use(log_path: str, model_index: int = 0):
+def use(log_path: str, model_index: int = 0, max_chunk_tokens: int = 0, quantization: str = None,
+        tune_threads: bool = False):
     # Load config of trained model.
     log = utils.load_json(log_path)
 
@@ -81,25 +81,42 @@ def use(log_path: str, model_index: int = 0):
     # Retrieve the last trained model.
     model = config.get_model_of_iter(model_index)
     model.eval()
+    if quantization is not None:
+        model = quantize.quantize(config, model, quantization, model_index)
+        device = torch.device('cpu')
+    inference.check_max_chunk_tokens(model, max_chunk_tokens)
+    policy = None
+    if tune_threads:
+        policy = thread_policy.thread_policy_of(model, device, os.path.basename(log_path).removesuffix('.json'),
+                                                model_index, variant=f"int8-{quantization}" if quantization else None)
 
     # Decodes model's task-specific hcodes to generic hcodes.
     task_decoder = {}
     for i, j in config.task_adapter[1].items():
         task_decoder[int(i)] = int(j)
 
+    # Control message 'p <num_forwards> [sub_dir]' profiles the next forwards, into a subdirectory of the profiles one.
+    forward_profiler = profiling.ForwardProfiler()
+
     with torch.no_grad():
         print("[ READY ]", flush=True)
 
         for line in sys.stdin:
             if line[0] == 'e':
                 break
+            elif line[0] == 'p':
+                args = line.split()
+                forward_profiler.arm(int(args[1]), args[2] if len(args) >= 3 else None)
             else:
                 # Create non negative input.
                 token_rules = list(map(lambda x: int(x) + 1, line.split()))
                 #
                 t0 = time.time_ns()
-                tens_token_rules = torch.tensor(token_rules, dtype=torch.long).to(device)
-                ps = torch.argmax(model(tens_token_rules), dim=1)
+                tens_token_rules = torch.tensor(token_rules, dtype=torch.long)
+                if policy is not None:
+                    policy.apply(len(tens_token_rules))
+                with forward_profiler.capture(f"{config.config_name}_{model_index}_{len(tens_token_rules)}"):
+                    ps = inference.predict(model, tens_token_rules, device, max_chunk_tokens=max_chunk_tokens)
                 t1 = time.time_ns()
                 #
                 model_cmp_time_ns = round(t1 - t0)
@@ -107,6 +124,37 @@ def use(log_path: str, model_index: int = 0):
                 print(outstr, flush=True)
 
 
+def use_batch(log_path: str, model_index: int = 0, max_batch_tokens: int = 32_768):
+    # Bulk counterpart of 'use': reads one line of token ids per file from stdin until its end, and prints one line of
+    # hcodes per file, in input order, evaluating files through length-bucketed padded batches.
+    log = utils.load_json(log_path)
+    config = utils.Config()
+    config.apply_config_of(log['config'])
+
+    model = config.get_model_of_iter(model_index)
+    model.eval()
+
+    # Create non negative inputs.
+    seqs = (torch.tensor(list(map(lambda x: int(x) + 1, line.split())), dtype=torch.long) for line in sys.stdin)
+    with torch.no_grad():
+        for ps in batcher.predict_bucketed(model, seqs, config.device, max_batch_tokens=max_batch_tokens):
+            print(" ".join([str(thc) for thc in ps.tolist()]), flush=True)
+
+
+def use_framed(log_path: str, model_index: int = 0, max_chunk_tokens: int = 0):
+    # Pipelined counterpart of 'use', speaking the length-prefixed binary protocol of framing.py on stdin/stdout.
+    log = utils.load_json(log_path)
+    config = utils.Config()
+    config.apply_config_of(log['config'])
+
+    model = config.get_model_of_iter(model_index)
+    model.eval()
+    inference.check_max_chunk_tokens(model, max_chunk_tokens)
+
+    print("[ READY ]", flush=True)
+    framing.serve(model, config.device, sys.stdin.fileno(), sys.stdout.buffer, max_chunk_tokens=max_chunk_tokens)
+
+
 def usepygments(lang: str):
     if lang == 'java':
         lang_lexer = JavaLexer()
@@ -129,7 +177,6 @@ def usepygments(lang: str):
     else:
         raise ValueError(lang + 'is not a valid language')
 
-    drop_formatter = pygments_utils.DropFormatter()
     json_formatter = pygments_utils.JSONFormatter(bindings)
 
     print("[ READY ]", flush=True)
@@ -139,22 +186,32 @@ def usepygments(lang: str):
             break
         else:
             sourcecode = json.loads(line)['source']
-            t0 = time.time_ns()
-            highlight(sourcecode, lang_lexer, drop_formatter)
-            t1 = time.time_ns()
-            print(str(t1 - t0) + "\n" + highlight(sourcecode, lang_lexer, json_formatter), flush=True)
+            lex_ns, res_json = pygments_utils.lex_and_format(sourcecode, lang_lexer, json_formatter)
+            print(str(lex_ns) + "\n" + res_json, flush=True)
 
 
 if __name__ == '__main__':
     if len(sys.argv) >= 3:
         if sys.argv[1] == 'use':
             log_path = sys.argv[2]
-            if len(sys.argv) == 4:
-                model_index = int(sys.argv[3])
-                use(log_path, model_index=model_index)
-            else:
-                use(log_path)
+            # Optional trailing arguments: model_index, max_chunk_tokens, quantization mode (or 'none'), 'tune'.
+            use(log_path,
+                model_index=int(sys.argv[3]) if len(sys.argv) >= 4 else 0,
+                max_chunk_tokens=int(sys.argv[4]) if len(sys.argv) >= 5 else 0,
+                quantization=sys.argv[5] if len(sys.argv) >= 6 and sys.argv[5] != 'none' else None,
+                tune_threads=len(sys.argv) >= 7 and sys.argv[6] == 'tune')
+        elif sys.argv[1] == 'usebatch':
+            use_batch(sys.argv[2],
+                      model_index=int(sys.argv[3]) if len(sys.argv) >= 4 else 0,
+                      max_batch_tokens=int(sys.argv[4]) if len(sys.argv) >= 5 else 32_768)
+        elif sys.argv[1] == 'useframed':
+            use_framed(sys.argv[2],
+                       model_index=int(sys.argv[3]) if len(sys.argv) >= 4 else 0,
+                       max_chunk_tokens=int(sys.argv[4]) if len(sys.argv) >= 5 else 0)
         elif sys.argv[1] == 'usepygments':
             usepygments(sys.argv[2])
+        elif sys.argv[1] == 'sweep':
+            training_seq(num_workers=int(sys.argv[2]),
+                         threads_per_worker=int(sys.argv[3]) if len(sys.argv) >= 4 else None)
     else:
         training_seq()
@@ -0,0 +1,124 @@
+import threading
+import time
+import contextlib
+from collections import deque
+
+# Server-side latency metrics, rendered in the Prometheus text exposition format.
+# Each (stage, model, input length bucket) keeps a summary over its latest SUMMARY_WINDOW observations, from which
+# the p50/p95/p99 quantiles are computed at scrape time.
+LENGTH_BUCKETS: [int] = [32, 128, 512, 2_048, 8_192, 32_768]
+QUANTILES: [float] = [0.5, 0.95, 0.99]
+SUMMARY_WINDOW: int = 1_024
+#
+STAGE_DECODE: str = 'decode'
+STAGE_LEX: str = 'lex'
+STAGE_CACHE_LOOKUP: str = 'cache_lookup'
+STAGE_TENSOR_BUILD: str = 'tensor_build'
+STAGE_DEVICE_TRANSFER: str = 'device_transfer'
+STAGE_FORWARD: str = 'forward'
+STAGE_ARGMAX: str = 'argmax'
+STAGE_ENCODE: str = 'encode'
+
+
+def length_bucket_of(length: int) -> str:
+    for max_length in LENGTH_BUCKETS:
+        if length <= max_length:
+            return str(max_length)
+    return '+Inf'
+
+
+def quantile_of(sorted_values: [float], q: float) -> float:
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))] if sorted_values else float('nan')
+
+
+class StageTimer:
+    # Splits a request's wall time into consecutive stages: each 'lap' closes the stage running since the last one.
+
+    def __init__(self):
+        self.laps: [(str, int)] = []
+        self._last: int = time.perf_counter_ns()
+
+    def lap(self, stage: str):
+        now = time.perf_counter_ns()
+        self.laps.append((stage, now - self._last))
+        self._last = now
+
+    @contextlib.contextmanager
+    def excluded(self):
+        # Leaves the time spent in the block out of the running stage.
+        t0 = time.perf_counter_ns()
+        try:
+            yield
+        finally:
+            self._last += time.perf_counter_ns() - t0
+
+
+class _NullStageTimer(StageTimer):
+    def __init__(self):
+        super().__init__()
+
+    def lap(self, stage: str):
+        pass
+
+
+NULL_STAGE_TIMER: StageTimer = _NullStageTimer()
+
+
+class _Summary:
+    def __init__(self):
+        self.window = deque(maxlen=SUMMARY_WINDOW)
+        self.count: int = 0
+        self.sum: float = 0.0
+
+    def observe(self, value: float):
+        self.window.append(value)
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q: float) -> float:
+        return quantile_of(sorted(self.window), q)
+
+
+def _labels_of(labels: dict) -> str:
+    return ','.join(f'{k}="{v}"' for k, v in labels.items())
+
+
+class Metrics:
+    def __init__(self):
+        self._stages: {(str, str, str): _Summary} = {}
+        # Name -> (help, type, callback returning [(labels dict, value)]), evaluated at scrape time.
+        self._gauges: {str: (str, str, callable)} = {}
+        self._lock = threading.Lock()
+
+    def observe(self, model_name: str, length: int, timer: StageTimer):
+        bucket = length_bucket_of(length)
+        with self._lock:
+            for stage, ns in timer.laps:
+                key = (stage, model_name, bucket)
+                summary = self._stages.get(key)
+                if summary is None:
+                    summary = self._stages[key] = _Summary()
+                summary.observe(ns / 1e9)
+
+    def register(self, name: str, help_text: str, metric_type: str, callback):
+        self._gauges[name] = (help_text, metric_type, callback)
+
+    def render(self) -> str:
+        lines = [
+            '# HELP highlighter_stage_seconds Latency of each stage of /eval_model requests.',
+            '# TYPE highlighter_stage_seconds summary'
+        ]
+        with self._lock:
+            for (stage, model_name, bucket), summary in sorted(self._stages.items()):
+                labels = {'stage': stage, 'model': model_name, 'length_bucket': bucket}
+                for q in QUANTILES:
+                    lines.append(f"highlighter_stage_seconds{{{_labels_of({**labels, 'quantile': q})}}} "
+                                 f"{summary.quantile(q)}")
+                lines.append(f"highlighter_stage_seconds_sum{{{_labels_of(labels)}}} {summary.sum}")
+                lines.append(f"highlighter_stage_seconds_count{{{_labels_of(labels)}}} {summary.count}")
+        for name, (help_text, metric_type, callback) in self._gauges.items():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {metric_type}")
+            for labels, value in callback():
+                lines.append(f"{name}{{{_labels_of(labels)}}} {value}" if labels else f"{name} {value}")
+        return '\n'.join(lines) + '\n'
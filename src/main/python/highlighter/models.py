@@ -1,6 +1,34 @@
 import torch
 
 
+def _rnn_forward_batch(module: torch.nn.Module, rnn: torch.nn.RNNBase, seqs: torch.Tensor, lengths: torch.Tensor):
+    # seqs: (batch, max_len) right-padded token ids, lengths: (batch,) true lengths.
+    # Sequences are packed so that padding never reaches the recurrent cells (nor the backward direction).
+    out = module.word_embeddings(seqs) if module.word_embeddings is not None else seqs.float().unsqueeze(2)
+    out = torch.nn.utils.rnn.pack_padded_sequence(out, lengths.cpu(), batch_first=True, enforce_sorted=False)
+    out, _ = rnn(out)
+    out, _ = torch.nn.utils.rnn.pad_packed_sequence(out, batch_first=True, total_length=seqs.shape[1])
+    out = module.fc1(out)
+    if not module.training:
+        out = torch.nn.functional.log_softmax(out, dim=2)
+    return out
+
+
+def _rnn_forward_with_state(module: torch.nn.Module, rnn: torch.nn.RNNBase, seq: torch.Tensor, hidden=None):
+    # Unidirectional only: evaluates 'seq' as the continuation of the sequence that left the recurrent state 'hidden'
+    # (None at the start of a sequence), returning the output alongside the state to carry over to the next chunk.
+    if module.is_bidirectional:
+        raise ValueError('A bidirectional model cannot carry its hidden state over chunks.')
+    n = seq.size(0)
+    out = module.word_embeddings(seq) if module.word_embeddings is not None else seq.float()
+    out = out.view(n, 1, -1)
+    out, hidden = rnn(out, hidden)
+    out = module.fc1(out.view(n, -1))
+    if not module.training:
+        out = torch.nn.functional.log_softmax(out, dim=1)
+    return out, hidden
+
+
 class LSTMClassifier1(torch.nn.Module):
 
     def __init__(self, embedding_dim, hidden_dim, vocab_size, tagset_size, num_lstm_layers, is_bidirectional):
@@ -19,7 +47,7 @@ class LSTMClassifier1(torch.nn.Module):
         self.fc1 = torch.nn.Linear(hidden_dim * 2 if is_bidirectional else hidden_dim, tagset_size)
 
     def forward(self, seq):
-        n = len(seq)
+        n = seq.size(0)
         out = self.word_embeddings(seq) if self.word_embeddings is not None else seq.float()
         out = out.view(n, 1, -1)
         out, _ = self.lstm1(out)
@@ -32,6 +60,12 @@ class LSTMClassifier1(torch.nn.Module):
             out = torch.nn.functional.log_softmax(out, dim=1)
         return out
 
+    def forward_batch(self, seqs, lengths):
+        return _rnn_forward_batch(self, self.lstm1, seqs, lengths)
+
+    def forward_with_state(self, seq, hidden=None):
+        return _rnn_forward_with_state(self, self.lstm1, seq, hidden)
+
 
 class GRUClassifier1(torch.nn.Module):
 
@@ -50,7 +84,7 @@ class GRUClassifier1(torch.nn.Module):
         self.fc1 = torch.nn.Linear(hidden_dim * 2 if is_bidirectional else hidden_dim, tagset_size)
 
     def forward(self, seq):
-        n = len(seq)
+        n = seq.size(0)
         out = self.word_embeddings(seq) if self.word_embeddings is not None else seq.float()
         out = out.view(n, 1, -1)
         out, _ = self.gru1(out)
@@ -63,6 +97,12 @@ class GRUClassifier1(torch.nn.Module):
             out = torch.nn.functional.log_softmax(out, dim=1)
         return out
 
+    def forward_batch(self, seqs, lengths):
+        return _rnn_forward_batch(self, self.gru1, seqs, lengths)
+
+    def forward_with_state(self, seq, hidden=None):
+        return _rnn_forward_with_state(self, self.gru1, seq, hidden)
+
 
 class RNNClassifier1(torch.nn.Module):
 
@@ -80,7 +120,7 @@ class RNNClassifier1(torch.nn.Module):
         self.fc1 = torch.nn.Linear(hidden_dim * 2 if is_bidirectional else hidden_dim, tagset_size)
 
     def forward(self, seq):
-        n = len(seq)
+        n = seq.size(0)
         out = self.word_embeddings(seq) if self.word_embeddings is not None else seq.float()
         out = out.view(n, 1, -1)
         out, _ = self.rnn(out)
@@ -93,6 +133,12 @@ class RNNClassifier1(torch.nn.Module):
             out = torch.nn.functional.log_softmax(out, dim=1)
         return out
 
+    def forward_batch(self, seqs, lengths):
+        return _rnn_forward_batch(self, self.rnn, seqs, lengths)
+
+    def forward_with_state(self, seq, hidden=None):
+        return _rnn_forward_with_state(self, self.rnn, seq, hidden)
+
 
 class CNNClassifier2(torch.nn.Module):
     def __init__(self, embedding_dim, hidden_dim, vocab_size, max_input_len, tagset_size, enc_kernel_size,
@@ -0,0 +1,217 @@
+import os
+import fcntl
+import hashlib
+import struct
+import tempfile
+import threading
+import contextlib
+from collections import OrderedDict
+from multiprocessing import shared_memory, resource_tracker
+import numpy as np
+import torch
+
+# Content-addressed cache of model predictions.
+# Entries are keyed by a digest of the loaded model's identity and of the raw token ids (as little-endian int32), and
+# hold the predicted hcodes as int16: a hit skips tensor construction and the forward entirely.
+_TOKEN_IDS_DTYPE: np.dtype = np.dtype('<i4')
+_DIGEST_SIZE: int = 16
+# Bookkeeping bytes accounted per entry on top of its hcodes.
+_ENTRY_OVERHEAD_BYTES: int = 128
+# Writer locks of a shared table, each guarding the slots of equal index modulo their number.
+_WRITER_LOCK_SHARDS: int = 256
+
+
+def token_ids_bytes_of(input_token_ids) -> bytes:
+    return np.asarray(input_token_ids, dtype=_TOKEN_IDS_DTYPE).tobytes()
+
+
+def digest_of(model_key, token_ids_bytes: bytes) -> bytes:
+    h = hashlib.blake2b(digest_size=_DIGEST_SIZE)
+    h.update(repr(model_key).encode())
+    h.update(token_ids_bytes)
+    return h.digest()
+
+
+class PredictionCache:
+    # In-process LRU cache, evicting least recently used entries beyond 'max_bytes'.
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes: int = max_bytes
+        self.hits: int = 0
+        self.misses: int = 0
+        self._entries: OrderedDict = OrderedDict()
+        self._bytes: int = 0
+        self._lock = threading.Lock()
+
+    def get(self, digest: bytes) -> torch.Tensor:
+        with self._lock:
+            ps = self._entries.get(digest)
+            if ps is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._entries.move_to_end(digest)
+            return ps
+
+    def put(self, digest: bytes, ps: torch.Tensor):
+        ps = ps.to(device='cpu', dtype=torch.int16)
+        size = ps.numel() * ps.element_size() + _ENTRY_OVERHEAD_BYTES
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(digest, None)
+            if old is not None:
+                self._bytes -= old.numel() * old.element_size() + _ENTRY_OVERHEAD_BYTES
+            self._entries[digest] = ps
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= evicted.numel() * evicted.element_size() + _ENTRY_OVERHEAD_BYTES
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'kind': 'local',
+                'hits': self.hits,
+                'misses': self.misses,
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes
+            }
+
+
+class SharedPredictionCache:
+    # Direct-mapped table in the named shared memory segment 'name', shared by every process attaching to it.
+    # A digest maps to a single slot, overwritten by whichever entry was put last ('slot_bytes' caps the hcodes of an
+    # entry, larger ones are not cached). Slot layout: [version u32][length u32][digest][hcodes].
+    # Writers mark a slot's version odd while they write it and readers discard a slot whose version is odd or changed
+    # while reading, so a torn entry is seen as a miss; hit/miss counters are per process.
+    # Writers exclude each other per shard of slots: across processes through byte-range locks of a sidecar file, one
+    # byte per shard, and within one through a lock per shard, as byte-range locks are held per process rather than per
+    # thread. A put finding its shard busy in another process is dropped rather than waiting.
+    # Closing waits for the gets and puts in flight, later ones miss.
+    _HEADER = struct.Struct(f"<II{_DIGEST_SIZE}s")
+    _VERSION = struct.Struct('<I')
+
+    def __init__(self, name: str, num_slots: int = 16_384, slot_bytes: int = 4_096, create: bool = False):
+        self.num_slots: int = num_slots
+        self.slot_bytes: int = slot_bytes
+        self._stride: int = self._HEADER.size + slot_bytes
+        self.hits: int = 0
+        self.misses: int = 0
+        if create:
+            self._shm = shared_memory.SharedMemory(name=name, create=True, size=num_slots * self._stride)
+            self._shm.buf[:] = bytes(len(self._shm.buf))
+        else:
+            self._shm = shared_memory.SharedMemory(name=name)
+            # Only the creator owns the segment: do not let this process' tracker unlink it at exit.
+            resource_tracker.unregister(self._shm._name, 'shared_memory')
+        self._is_owner: bool = create
+        self._lock_path: str = os.path.join(tempfile.gettempdir(), f"{self._shm.name.lstrip('/')}.lock")
+        self._lock_fd: int = os.open(self._lock_path, os.O_RDWR | os.O_CREAT, 0o600)
+        self._shard_locks: [threading.Lock] = [threading.Lock() for _ in range(_WRITER_LOCK_SHARDS)]
+        # Guards the counters, and the segment against closing while in use.
+        self._state = threading.Condition()
+        self._users: int = 0
+        self._is_closed: bool = False
+
+    @staticmethod
+    def open_or_create(name: str) -> 'SharedPredictionCache':
+        try:
+            return SharedPredictionCache(name)
+        except FileNotFoundError:
+            try:
+                return SharedPredictionCache(name, create=True)
+            except FileExistsError:
+                # Created by another process meanwhile.
+                return SharedPredictionCache(name)
+
+    def _offset_of(self, digest: bytes) -> int:
+        return (int.from_bytes(digest[:8], 'little') % self.num_slots) * self._stride
+
+    @contextlib.contextmanager
+    def _buffer(self):
+        # The segment's buffer, None once closed.
+        with self._state:
+            is_closed = self._is_closed
+            if not is_closed:
+                self._users += 1
+        if is_closed:
+            yield None
+            return
+        try:
+            yield self._shm.buf
+        finally:
+            with self._state:
+                self._users -= 1
+                self._state.notify_all()
+
+    def get(self, digest: bytes) -> torch.Tensor:
+        ps = None
+        with self._buffer() as buf:
+            if buf is not None:
+                offset = self._offset_of(digest)
+                version, length, slot_digest = self._HEADER.unpack_from(buf, offset)
+                if version % 2 == 0 and slot_digest == digest:
+                    start = offset + self._HEADER.size
+                    payload = bytearray(buf[start:start + length])
+                    if self._VERSION.unpack_from(buf, offset)[0] == version:
+                        ps = torch.frombuffer(payload, dtype=torch.int16) if length > 0 \
+                            else torch.zeros(0, dtype=torch.int16)
+        with self._state:
+            if ps is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return ps
+
+    def put(self, digest: bytes, ps: torch.Tensor):
+        payload = ps.to(device='cpu', dtype=torch.int16).numpy().tobytes()
+        if len(payload) > self.slot_bytes:
+            return
+        offset = self._offset_of(digest)
+        shard = (offset // self._stride) % _WRITER_LOCK_SHARDS
+        with self._shard_locks[shard], self._buffer() as buf:
+            if buf is None:
+                return
+            try:
+                fcntl.lockf(self._lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB, 1, shard)
+            except OSError:
+                # Another process is writing to this shard.
+                return
+            try:
+                version = self._VERSION.unpack_from(buf, offset)[0]
+                self._VERSION.pack_into(buf, offset, (version + 1) % 2 ** 32)
+                start = offset + self._HEADER.size
+                buf[start:start + len(payload)] = payload
+                self._HEADER.pack_into(buf, offset, (version + 1) % 2 ** 32, len(payload), digest)
+                self._VERSION.pack_into(buf, offset, (version + 2) % 2 ** 32)
+            finally:
+                fcntl.lockf(self._lock_fd, fcntl.LOCK_UN, 1, shard)
+
+    def stats(self) -> dict:
+        with self._state:
+            return {
+                'kind': 'shared',
+                'name': self._shm.name,
+                'hits': self.hits,
+                'misses': self.misses,
+                'slots': self.num_slots,
+                'slot_bytes': self.slot_bytes
+            }
+
+    def close(self):
+        with self._state:
+            if self._is_closed:
+                return
+            self._is_closed = True
+            while self._users > 0:
+                self._state.wait()
+        self._shm.close()
+        os.close(self._lock_fd)
+        if self._is_owner:
+            self._shm.unlink()
+            try:
+                os.unlink(self._lock_path)
+            except FileNotFoundError:
+                pass
@@ -0,0 +1,131 @@
+import os
+import sys
+import signal
+import socket
+# Workers are forked from the process that loaded the models: CUDA must stay uninitialised, serve on CPU.
+os.environ.setdefault('CUDA_VISIBLE_DEVICES', '')
+import torch
+from werkzeug.serving import make_server
+#
+import http_server as http_server
+import inference as inference
+import warmup as warmup
+
+# Pre-forked serving of http_server's app.
+#   python prefork_server.py <num_workers> <threads_per_worker> <model_log_name>:<model_index> [...]
+#       [<option>=<value> ...]
+# The parent loads every model once and moves its weights to shared memory, then forks the workers: they all map the
+# same read-only weights and accept connections from the same listening socket. The first model is the default one
+# of requests naming none.
+# Options are those of /load_model (see OPTION_TYPES), applied to every preloaded model by every worker, e.g. the
+# batching window or the shared prediction cache 'prediction_cache_shm' of all workers. /load_model itself is not
+# supported under pre-forking: it only reaches the worker serving that request, leaving workers configured apart.
+# Every worker warms the preloaded models up before accepting connections, so that it serves at steady state speed:
+# warm-up forwards must not run in the parent, whose OpenMP thread pool would not survive the fork.
+HOST: str = '127.0.0.1'
+PORT: int = 5000
+LISTEN_BACKLOG: int = 128
+OPTION_TYPES: {str: type} = {
+    'batch_max_wait_ms': float,
+    'batch_max_tokens': int,
+    'max_chunk_tokens': int,
+    'tune_threads': lambda v: v == 'true',
+    'prediction_cache_bytes': int,
+    'prediction_cache_shm': str
+}
+
+
+def preload(model_names: [(str, int)], options: dict):
+    # Weights and the prediction cache, inherited by every worker (the parent owns a shared table, released at its
+    # exit). Batchers and thread policies are set up by each worker: threads do not survive the fork, and calibration
+    # runs forwards.
+    http_server.configure_prediction_cache(options)
+    model_options = http_server.model_options_of(options)
+    for model_log_name, model_index in model_names:
+        entry = http_server.model_registry.load(model_log_name, model_index)
+        entry.model.share_memory()
+        inference.check_max_chunk_tokens(entry.model, model_options["max_chunk_tokens"])
+        http_server.model_options[(model_log_name, model_index, False, None)] = model_options
+    model_log_name, model_index = model_names[0]
+    http_server.default_model_name = (model_log_name, model_index, False, None)
+
+
+def _set_up():
+    for name in list(http_server.model_options.keys()):
+        entry = http_server.configured_model(name)
+        warmup_ns, _ = warmup.warm_up(entry)
+        print(f"Worker {os.getpid()} warmed up {entry.name} in {warmup_ns / 1e6:.1f} ms", flush=True)
+    http_server.is_ready = True
+
+
+def _worker(sock: socket.socket, threads_per_worker: int):
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    # Intra-op threads per worker, so that workers do not oversubscribe the cores.
+    torch.set_num_threads(threads_per_worker)
+    _set_up()
+    server = make_server(HOST, PORT, http_server.app, threaded=True, fd=sock.fileno())
+    server.serve_forever()
+
+
+def serve(num_workers: int, threads_per_worker: int, model_names: [(str, int)], options: dict):
+    preload(model_names, options)
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((HOST, PORT))
+    sock.listen(LISTEN_BACKLOG)
+    sock.set_inheritable(True)
+
+    workers = set()
+
+    def spawn():
+        pid = os.fork()
+        if pid == 0:
+            try:
+                _worker(sock, threads_per_worker)
+            finally:
+                os._exit(0)
+        workers.add(pid)
+
+    for _ in range(num_workers):
+        spawn()
+
+    def stop(signum, frame):
+        for pid in workers:
+            os.kill(pid, signal.SIGTERM)
+        sys.exit(0)
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    print(f"[ READY ] {num_workers} workers on {HOST}:{PORT}", flush=True)
+    while True:
+        pid, status = os.wait()
+        if pid in workers:
+            workers.remove(pid)
+            print(f"Worker {pid} exited with status {status}, respawning.", file=sys.stderr)
+            spawn()
+
+
+def _model_name_of(arg: str) -> (str, int):
+    model_log_name, model_index = arg.rsplit(':', 1)
+    return model_log_name.removesuffix('.json'), int(model_index)
+
+
+def _options_of(args: [str]) -> dict:
+    options = {}
+    for arg in args:
+        name, value = arg.split('=', 1)
+        if name not in OPTION_TYPES:
+            raise ValueError(f"Unknown option '{name}', expected one of {list(OPTION_TYPES.keys())}.")
+        options[name] = OPTION_TYPES[name](value)
+    return options
+
+
+if __name__ == '__main__':
+    if len(sys.argv) >= 4:
+        serve(int(sys.argv[1]), int(sys.argv[2]), [_model_name_of(arg) for arg in sys.argv[3:] if '=' not in arg],
+              _options_of([arg for arg in sys.argv[3:] if '=' in arg]))
+    else:
+        print(f"Unknown command sequence {sys.argv[1:]}")
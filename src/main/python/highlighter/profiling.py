@@ -0,0 +1,65 @@
+import os
+import sys
+import threading
+import contextlib
+import torch
+from torch.profiler import profile, ProfilerActivity
+
+# On-demand operator level profiling of live forwards.
+# Arming a ForwardProfiler wraps its next N captured forwards in torch.profiler: each one writes a Chrome trace
+# (chrome://tracing, Perfetto) and a summary table of operator timings and memory to the output directory.
+# Unarmed, a capture is a shared no-op context manager: serving pays a single integer comparison.
+# Captures enter as True when profiled and False otherwise.
+# Profiles are written under the profiler's root directory only: callers may name a subdirectory of it, but no path
+# resolving outside of it.
+DEFAULT_PROFILES_DIR: str = '../profiles'
+SUMMARY_ROW_LIMIT: int = 40
+
+_DISABLED = contextlib.nullcontext(False)
+
+
+class ForwardProfiler:
+    def __init__(self, root_dir: str = DEFAULT_PROFILES_DIR):
+        self.remaining: int = 0
+        self.root_dir: str = os.path.realpath(root_dir)
+        self.out_dir: str = self.root_dir
+        self._next_index: int = 0
+        self._lock = threading.Lock()
+
+    def out_dir_of(self, sub_dir: str) -> str:
+        out_dir = os.path.realpath(os.path.join(self.root_dir, sub_dir))
+        if os.path.commonpath([out_dir, self.root_dir]) != self.root_dir:
+            raise ValueError(f"Profile directory '{sub_dir}' is outside of {self.root_dir}.")
+        return out_dir
+
+    def arm(self, num_forwards: int, sub_dir: str = None):
+        out_dir = self.out_dir_of(sub_dir) if sub_dir is not None else self.root_dir
+        with self._lock:
+            self.remaining = max(0, num_forwards)
+            self.out_dir = out_dir
+
+    def capture(self, label: str):
+        if self.remaining <= 0:
+            return _DISABLED
+        with self._lock:
+            if self.remaining <= 0:
+                return _DISABLED
+            self.remaining -= 1
+            index = self._next_index
+            self._next_index += 1
+        return self._profile(f"{index:04d}_{label}")
+
+    @contextlib.contextmanager
+    def _profile(self, name: str):
+        activities = [ProfilerActivity.CPU]
+        if torch.cuda.is_available():
+            activities.append(ProfilerActivity.CUDA)
+        with profile(activities=activities, record_shapes=True, profile_memory=True) as prof:
+            yield True
+        os.makedirs(self.out_dir, exist_ok=True)
+        path = os.path.join(self.out_dir, name)
+        prof.export_chrome_trace(f"{path}.trace.json")
+        sort_by = 'self_cuda_time_total' if torch.cuda.is_available() else 'self_cpu_time_total'
+        with open(f"{path}.txt", 'w') as f:
+            f.write(prof.key_averages(group_by_input_shape=True).table(sort_by=sort_by, row_limit=SUMMARY_ROW_LIMIT))
+        print(f"Profile written to {path}.trace.json", file=sys.stderr)
@@ -1,7 +1,9 @@
-import sys
+import io
 import json
+import time
 from typing import Final
 from pygments.formatter import Formatter
+from pygments.token import string_to_tokentype
 import utils as utils
 
 
@@ -14,7 +16,9 @@ class DropFormatter(Formatter):
         Formatter.__init__(self, **options)
 
     def formatter(self, tokensource, outfile):
-        pass
+        # Lexers are lazy: drain the stream so that lexing actually happens.
+        for _ in tokensource:
+            pass
 
     def format_unencoded(self, tokensource, outfile):
         self.formatter(tokensource, outfile)
@@ -28,12 +32,17 @@ class JSONFormatter(Formatter):
     def __init__(self, bindings, **options):
         Formatter.__init__(self, **options)
         self.bindings = bindings
+        self.bindings_table = bindings_table_of(bindings)
 
     def formatter(self, tokensource, outfile):
+        table = self.bindings_table.table
+        resolve = self.bindings_table.resolve
         sols = []
         for ttype, value in tokensource:
-            sttype = str(ttype)
-            sols.append((str(value), sttype, to_oracle_bindings(sttype, bindings=self.bindings)))
+            sttype_hcode = table.get(ttype)
+            if sttype_hcode is None:
+                sttype_hcode = resolve(ttype)
+            sols.append((str(value), *sttype_hcode))
         outfile.write(json.dumps(sols, sort_keys=False))
         outfile.flush()
 
@@ -57,8 +66,6 @@ _FUNCTION_IDENTIFIER = utils.FUNCTION_IDENTIFIER[0]
 _FIELD_IDENTIFIER = utils.FIELD_IDENTIFIER[0]
 _ANNOTATION_DECLARATOR = utils.ANNOTATION_DECLARATOR[0]
 #
-_UNKNOWN_PYGMENT_TOKEN_TYPE = -1
-#
 # As reported from:
 #   https://pygments.org/docs/tokens/#module-pygments.token
 #   last reviewed on the 21/08/2021.
@@ -247,9 +254,50 @@ CPP_ORACLE_BINDINGS = _TO_ORACLE_BASE_BINDINGS
 CS_ORACLE_BINDINGS = _TO_ORACLE_BASE_BINDINGS
 
 
-def to_oracle_bindings(pygment_token_type: str, bindings=_TO_ORACLE_BASE_BINDINGS) -> int:
-    ob = bindings.get(pygment_token_type, _UNKNOWN_PYGMENT_TOKEN_TYPE)
-    if ob == _UNKNOWN_PYGMENT_TOKEN_TYPE:
-        print(f"Unrecognised Pygment token type {pygment_token_type}", file=sys.stderr)
-        ob = _ANY
-    return ob
+class OracleBindingsTable:
+    # Memoised pygments token type -> (token type name, hcode) table of a bindings dict.
+    # Token types missing from the bindings resolve to the hcode of their closest bound parent (ANY if none is), and are
+    # counted per occurrence in 'unknown_counts' rather than reported per token.
+
+    def __init__(self, bindings: dict[str, int]):
+        self.bindings = bindings
+        self.table: dict = {}
+        for sttype, hcode in bindings.items():
+            self.table[string_to_tokentype(sttype)] = (sttype, hcode)
+        self.unknown_counts: dict[str, int] = {}
+        self._unknown_table: dict = {}
+
+    def resolve(self, ttype) -> (str, int):
+        sttype_hcode = self._unknown_table.get(ttype)
+        if sttype_hcode is None:
+            parent = ttype.parent
+            while parent is not None and parent not in self.table:
+                parent = parent.parent
+            sttype_hcode = (str(ttype), self.table[parent][1] if parent is not None else _ANY)
+            self._unknown_table[ttype] = sttype_hcode
+        self.unknown_counts[sttype_hcode[0]] = self.unknown_counts.get(sttype_hcode[0], 0) + 1
+        return sttype_hcode
+
+
+_BINDINGS_TABLES: dict[int, OracleBindingsTable] = {}
+
+
+def bindings_table_of(bindings: dict[str, int]) -> OracleBindingsTable:
+    # One table per bindings object, shared by all of its formatters.
+    table = _BINDINGS_TABLES.get(id(bindings))
+    if table is None or table.bindings is not bindings:
+        table = OracleBindingsTable(bindings)
+        _BINDINGS_TABLES[id(bindings)] = table
+    return table
+
+
+def lex_and_format(src: str, lexer, formatter: Formatter) -> (int, str):
+    # Single pass equivalent of timing 'highlight(src, lexer, DropFormatter())' and then returning
+    # 'highlight(src, lexer, formatter)': the token stream is materialised once, timing the lexing alone, and the same
+    # tokens are formatted.
+    t0 = time.time_ns()
+    tokens = list(lexer.get_tokens(src))
+    t1 = time.time_ns()
+    outfile = io.StringIO()
+    formatter.format(tokens, outfile)
+    return t1 - t0, outfile.getvalue()
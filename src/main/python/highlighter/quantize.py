@@ -0,0 +1,85 @@
+import sys
+import time
+import torch
+from torch.ao.quantization import quantize_dynamic, get_default_qconfig_mapping
+from torch.ao.quantization.quantize_fx import prepare_fx, convert_fx
+#
+import utils as utils
+import cnn as cnn
+import evaluator as evaluator
+
+# Int8 quantized inference, CPU only.
+#   'dynamic': int8 weights with activations quantized on the fly, for the Linear layers and LSTM/GRU stacks (plain
+#              RNNs and convolutions stay float).
+#   'static':  CNNClassifier1 only; int8 convolutions and Linear layers with activation ranges calibrated on the
+#              fold's snippets. Embeddings stay float.
+DYNAMIC: str = 'dynamic'
+STATIC: str = 'static'
+QUANTIZATION_MODES: [str] = [DYNAMIC, STATIC]
+QUANTIZATION_BACKEND: str = 'x86'
+CALIBRATION_SIZE: int = 500
+
+
+def quantize_dynamic_of(model: torch.nn.Module) -> torch.nn.Module:
+    return quantize_dynamic(model.cpu().eval(), {torch.nn.Linear, torch.nn.LSTM, torch.nn.GRU}, dtype=torch.qint8)
+
+
+def quantize_static_of(model: cnn.CNNClassifier1, calibration_inputs: [torch.Tensor]) -> torch.nn.Module:
+    if not isinstance(model, cnn.CNNClassifier1):
+        raise ValueError(f"Static quantization requires a {utils.CNNClassifier1}.")
+    torch.backends.quantized.engine = QUANTIZATION_BACKEND
+    qconfig_mapping = get_default_qconfig_mapping(QUANTIZATION_BACKEND).set_object_type(torch.nn.Embedding, None)
+    model = model.cpu().eval()
+    prepared = prepare_fx(model, qconfig_mapping, example_inputs=(calibration_inputs[0],))
+    with torch.no_grad():
+        for seq in calibration_inputs:
+            prepared(seq)
+    quantized = convert_fx(prepared)
+    # Keeps the attributes other inference paths rely on.
+    quantized.receptive_radius = model.receptive_radius
+    return quantized
+
+
+def quantize(config: utils.Config, model: torch.nn.Module, mode: str, fold_num: int) -> torch.nn.Module:
+    if mode == DYNAMIC:
+        return quantize_dynamic_of(model)
+    elif mode == STATIC:
+        snip_inputs, _ = config.get_cache_snippets_of_fold(fold_num)
+        return quantize_static_of(model, snip_inputs[:CALIBRATION_SIZE])
+    else:
+        raise ValueError(f"Unknown quantization mode '{mode}', expected one of {QUANTIZATION_MODES}.")
+
+
+def report(log_path: str, model_index: int = 0, mode: str = DYNAMIC) -> dict:
+    # Accuracy and speed of the quantized model against the float one, on the test fold the model was trained for.
+    log = utils.load_json(log_path)
+    config = utils.Config(device=torch.device('cpu'))
+    config.apply_config_of(log['config'])
+
+    float_model = config.get_model_of_iter(model_index)
+    float_model.eval()
+    quantized_model = quantize(config, config.get_model_of_iter(model_index), mode, model_index)
+
+    test_inputs, test_targets = config.get_cache_testing_of_fold(model_index)
+    loss_function = torch.nn.CrossEntropyLoss()
+
+    res = {'mode': mode}
+    for name, model in [('float', float_model), ('quantized', quantized_model)]:
+        with torch.no_grad():
+            t0 = time.time_ns()
+            avg_acc, loss_sum, _, _, _, _ = evaluator.acc_of_all(model, test_inputs, test_targets, loss_function,
+                                                                 msg=f"Testing - {name}")
+            t1 = time.time_ns()
+        res[name] = {'avg_acc': avg_acc, 'loss_sum': loss_sum, 'ns': t1 - t0}
+    res['avg_acc_delta'] = res['quantized']['avg_acc'] - res['float']['avg_acc']
+    return res
+
+
+if __name__ == '__main__':
+    if len(sys.argv) >= 3 and sys.argv[1] == 'report':
+        print(report(
+            sys.argv[2],
+            model_index=int(sys.argv[3]) if len(sys.argv) >= 4 else 0,
+            mode=sys.argv[4] if len(sys.argv) >= 5 else DYNAMIC))
+    else:
+        print(f"Unknown command sequence {sys.argv[1:]}")
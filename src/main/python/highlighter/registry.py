@@ -0,0 +1,166 @@
+import threading
+import os.path
+from collections import OrderedDict
+import torch
+#
+import utils as utils
+import batcher as batcher
+import scripted as scripted
+import quantize as quantize
+import spans as spans
+
+
+def load_trained_model(model_log_name: str, model_index: int) -> (utils.Config, torch.nn.Module):
+    # Load config of trained model.
+    log = utils.load_json(f"../saved_model_losses/{model_log_name}.json")
+
+    # Rebuild original config.
+    config = utils.Config()
+    config.apply_config_of(log['config'])
+
+    # Retrieve the trained model of the given fold.
+    model = config.get_model_of_iter(model_index)
+    model.eval()
+    return config, model
+
+
+def load_scripted_model(model_log_name: str, model_index: int) -> (dict, torch.jit.ScriptModule, torch.device, int):
+    path = scripted.scripted_model_path_of(model_log_name, model_index)
+    device = torch.device('cuda:0' if torch.cuda.is_available() else 'cpu')
+    config, model = scripted.load(path, device)
+    # Frozen weights are constants rather than parameters: account for them by the artifact's size.
+    return config, model, device, os.path.getsize(path)
+
+
+def _tensors_bytes_of(value) -> int:
+    if isinstance(value, torch.Tensor):
+        return value.numel() * value.element_size()
+    if isinstance(value, (tuple, list)):
+        return sum(_tensors_bytes_of(v) for v in value)
+    if isinstance(value, torch._C.ScriptObject) and hasattr(value, '__getstate__'):
+        # Packed weights of quantized LSTM/GRU stacks.
+        return _tensors_bytes_of(value.__getstate__())
+    return 0
+
+
+def model_size_bytes(model: torch.nn.Module) -> int:
+    # Size of the weights and buffers, from the state dict rather than 'parameters()': quantized layers keep their
+    # weights packed, outside of the latter.
+    return sum(_tensors_bytes_of(v) for v in model.state_dict().values())
+
+
+def model_key_of(config: dict, model_index: int, variant: str = None) -> (str, int, int, str, int):
+    # Scripted and quantized variants are registered apart from the eager model they derive from; runs of the same
+    # configuration are distinct models.
+    config_name = config['config_name'] + (f".{variant}" if variant is not None else '')
+    return config['lang_name'], utils.task_code_of(config['task']), int(config['run_code']), config_name, model_index
+
+
+class RegisteredModel:
+    def __init__(self, key: (str, int, int, str, int), model: torch.nn.Module, device, size_bytes: int,
+                 variant: str = None, task_decoder: torch.Tensor = None):
+        self.key = key
+        # Label of the model in metrics.
+        self.name: str = '/'.join(map(str, key))
+        self.variant: str = variant
+        self.model = model
+        self.device = device
+        self.size_bytes: int = size_bytes
+        # Task hcode -> generic hcode lookup table, see spans.py.
+        self.task_decoder: torch.Tensor = task_decoder
+        self.batcher = None
+        # Token budget of chunked inference, 0 evaluates every input in a single forward.
+        self.max_chunk_tokens: int = 0
+        # Input length -> intra-op threads policy, None leaves torch's thread count alone.
+        self.thread_policy = None
+        # Serving options the above were set up from, if any (see http_server's /load_model).
+        self.load_options: dict = None
+
+    def enable_batching(self, max_wait_ms: float, max_batch_tokens: int):
+        old = self.batcher
+        if old is not None and old.max_wait_s == max_wait_ms / 1000 and old.max_batch_tokens == max_batch_tokens:
+            old.thread_policy = self.thread_policy
+            return
+        new = None
+        if max_wait_ms > 0:
+            new = batcher.DynamicBatcher(self.model, self.device, max_wait_ms=max_wait_ms,
+                                         max_batch_tokens=max_batch_tokens, thread_policy=self.thread_policy)
+        # Swapped before closing: new requests go to the new batcher while the old one drains its queue.
+        self.batcher = new
+        if old is not None:
+            old.close()
+
+    def disable_batching(self):
+        old, self.batcher = self.batcher, None
+        if old is not None:
+            old.close()
+
+
+class ModelRegistry:
+    # Holds many trained models at once, keyed by (lang, task code, run code, config name, fold index).
+    # Models are evicted least recently used first whenever the total size of their weights exceeds 'max_bytes'; the
+    # most recently requested model is never evicted, even if alone it exceeds the budget.
+
+    def __init__(self, max_bytes: int = 2 * 1024 ** 3):
+        self.max_bytes: int = max_bytes
+        self._models: OrderedDict = OrderedDict()
+        self._names: {(str, int): (str, int, int, str, int)} = {}
+        self._lock = threading.RLock()
+
+    def load(self, model_log_name: str, model_index: int, is_scripted: bool = False,
+             quantization: str = None) -> RegisteredModel:
+        name = (model_log_name, model_index, is_scripted, quantization)
+        with self._lock:
+            key = self._names.get(name)
+            if key is not None and key in self._models:
+                self._models.move_to_end(key)
+                return self._models[key]
+        # Loading happens outside the lock so that other models keep serving meanwhile.
+        if is_scripted and quantization is not None:
+            raise ValueError('Scripted models cannot be quantized: quantize the eager model instead.')
+        variant = None
+        if is_scripted:
+            config, model, device, size_bytes = load_scripted_model(model_log_name, model_index)
+            variant = 'scripted'
+        else:
+            config, model = load_trained_model(model_log_name, model_index)
+            device = config.device
+            if quantization is not None:
+                model = quantize.quantize(config, model, quantization, model_index)
+                device = torch.device('cpu')
+                variant = f"int8-{quantization}"
+            config, size_bytes = config.json_encode_config(), model_size_bytes(model)
+        key = model_key_of(config, model_index, variant=variant)
+        with self._lock:
+            entry = self._models.get(key)
+            if entry is None:
+                entry = RegisteredModel(key, model, device, size_bytes, variant=variant,
+                                        task_decoder=spans.task_decoder_of(config['task_adapter']))
+                self._models[key] = entry
+            self._names[name] = key
+            self._models.move_to_end(key)
+            evicted = self._evict()
+        # Closing a batcher waits for its pending batch: not while holding the lock.
+        for old_entry in evicted:
+            old_entry.disable_batching()
+        return entry
+
+    def keys(self) -> [(str, int, int, str, int)]:
+        with self._lock:
+            return list(self._models.keys())
+
+    def entries(self) -> [RegisteredModel]:
+        with self._lock:
+            return list(self._models.values())
+
+    def total_bytes(self) -> int:
+        with self._lock:
+            return sum(e.size_bytes for e in self._models.values())
+
+    def _evict(self) -> [RegisteredModel]:
+        evicted = []
+        while len(self._models) > 1 and self.total_bytes() > self.max_bytes:
+            key, entry = self._models.popitem(last=False)
+            self._names = {n: k for n, k in self._names.items() if k != key}
+            evicted.append(entry)
+        return evicted
@@ -0,0 +1,87 @@
+import sys
+import json
+import time
+import torch
+
+# Frozen TorchScript inference artifacts of trained models.
+# An artifact maps non negative token rules straight to hcodes (argmax fused, dropout removed) and embeds the json
+# config of the model it was exported from; loading one needs nothing but torch.
+CONFIG_EXTRA_FILE: str = 'config.json'
+
+
+def scripted_model_path_of(model_log_name: str, model_index: int) -> str:
+    return f"../saved_models/{model_log_name}_{model_index}.scripted.pt"
+
+
+class _HCodesModel(torch.nn.Module):
+    def __init__(self, model: torch.nn.Module):
+        super().__init__()
+        self.model = model
+
+    def forward(self, token_rules):
+        return torch.argmax(self.model(token_rules), dim=1)
+
+
+def export(log_path: str, model_index: int = 0) -> str:
+    # Training code is only needed here, not to load the artifact.
+    import os.path
+    import utils as utils
+
+    # Load config of trained model.
+    log = utils.load_json(log_path)
+
+    # Rebuild original config.
+    config = utils.Config(device=torch.device('cpu'))
+    config.apply_config_of(log['config'])
+
+    model = _HCodesModel(config.get_model_of_iter(model_index)).eval()
+    # Shapes are traced symbolically: any example length serves every input length.
+    example = torch.randint(0, config.input_dim, (64,), dtype=torch.long)
+    with torch.no_grad():
+        traced = torch.jit.trace(model, example)
+    frozen = torch.jit.optimize_for_inference(traced)
+
+    model_log_name = os.path.basename(log_path).removesuffix('.json')
+    path = scripted_model_path_of(model_log_name, model_index)
+    # Not 'log['config']': the config took it over as its attributes, device included.
+    torch.jit.save(frozen, path, _extra_files={CONFIG_EXTRA_FILE: json.dumps(config.json_encode_config())})
+    return path
+
+
+def load(path: str, device) -> (dict, torch.jit.ScriptModule):
+    extra_files = {CONFIG_EXTRA_FILE: ''}
+    model = torch.jit.load(path, map_location=device, _extra_files=extra_files)
+    return json.loads(extra_files[CONFIG_EXTRA_FILE]), model
+
+
+def use(path: str):
+    device = torch.device('cuda:0' if torch.cuda.is_available() else 'cpu')
+    _, model = load(path, device)
+
+    with torch.no_grad():
+        print("[ READY ]", flush=True)
+
+        for line in sys.stdin:
+            if line[0] == 'e':
+                break
+            else:
+                # Create non negative input.
+                token_rules = list(map(lambda x: int(x) + 1, line.split()))
+                #
+                t0 = time.time_ns()
+                tens_token_rules = torch.tensor(token_rules, dtype=torch.long).to(device)
+                ps = model(tens_token_rules)
+                t1 = time.time_ns()
+                #
+                model_cmp_time_ns = round(t1 - t0)
+                outstr = f'{model_cmp_time_ns}\n{" ".join([str(thc) for thc in ps.tolist()])}'
+                print(outstr, flush=True)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) >= 3 and sys.argv[1] == 'export':
+        print(export(sys.argv[2], int(sys.argv[3]) if len(sys.argv) == 4 else 0))
+    elif len(sys.argv) == 3 and sys.argv[1] == 'use':
+        use(sys.argv[2])
+    else:
+        print(f"Unknown command sequence {sys.argv[1:]}")
@@ -0,0 +1,36 @@
+import torch
+
+# Character level output of the model server.
+# Predictions are decoded from the model's task-specific hcodes to the generic hcodes of utils.NAME_MAP, then adjacent
+# tokens of the same hcode are merged into a single character span: [first token's start, last token's stop, hcode].
+# Offsets keep the convention of the token offsets they are given (ANTLR's, with inclusive stops). Empty tokens, as the
+# trailing EOF ([len, len - 1]), cover no character and are left out of the spans.
+
+
+def task_decoder_of(task_adapter) -> torch.Tensor:
+    # Lookup table of task hcode -> generic hcode, from the adapter of a (possibly json decoded) config.
+    decoder = {int(i): int(j) for i, j in task_adapter[1].items()}
+    table = torch.zeros(max(decoder.keys()) + 1, dtype=torch.long)
+    table[list(decoder.keys())] = torch.tensor(list(decoder.values()), dtype=torch.long)
+    return table
+
+
+def char_spans_of(ps: torch.Tensor, task_decoder: torch.Tensor, token_starts: torch.Tensor,
+                  token_stops: torch.Tensor) -> (torch.Tensor, torch.Tensor, torch.Tensor):
+    # Returns the starts, stops and generic hcodes of the runs of same hcode tokens.
+    hcodes = task_decoder[ps.long()]
+    is_nonempty = token_stops >= token_starts
+    if not bool(is_nonempty.all()):
+        hcodes, token_starts, token_stops = hcodes[is_nonempty], token_starts[is_nonempty], token_stops[is_nonempty]
+    if len(hcodes) == 0:
+        return token_starts, token_stops, hcodes
+    is_run_start = torch.ones(len(hcodes), dtype=torch.bool)
+    is_run_start[1:] = hcodes[1:] != hcodes[:-1]
+    run_firsts = torch.nonzero(is_run_start).squeeze(1)
+    run_lasts = torch.cat([run_firsts[1:] - 1, run_firsts.new_tensor([len(hcodes) - 1])])
+    return token_starts[run_firsts], token_stops[run_lasts], hcodes[run_firsts]
+
+
+def flat_spans_of(starts: torch.Tensor, stops: torch.Tensor, hcodes: torch.Tensor) -> [int]:
+    # [start0, stop0, hcode0, start1, ...], the wire form of the spans.
+    return torch.stack([starts, stops, hcodes], dim=1).flatten().tolist()
@@ -0,0 +1,151 @@
+import os
+import time
+import traceback
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from concurrent.futures.process import BrokenProcessPool
+import torch
+#
+import utils as utils
+import trainer as trainer
+
+# Parallel, resumable sweep over training configurations.
+# Configurations (as Config keyword arguments) are trained by a pool of processes, each limited to 'threads_per_worker'
+# intra-op threads so that the pool does not oversubscribe the cores. The state of every job lives in a json ledger,
+# keyed by the configuration's loss log path and rewritten (atomically) on every change:
+#   queued -> running -> done | failed
+# Rerunning a sweep resumes it: jobs left 'running' by a crashed sweep are queued again (and resume from their
+# checkpoints, see trainer.train_fold), 'done' ones are skipped, as are configurations whose loss log already holds
+# every fold, whatever their state; 'failed' ones are only retried on request.
+# Jobs are started cheapest first, by an estimate of their training cost.
+# A worker dying (e.g. killed when out of memory) breaks the whole pool: the pool is rebuilt and the jobs it was running
+# are queued again, until they have been running in MAX_POOL_BREAKS broken pools, then they fail.
+QUEUED: str = 'queued'
+RUNNING: str = 'running'
+DONE: str = 'done'
+FAILED: str = 'failed'
+DEFAULT_LEDGER_PATH: str = '../saved_model_losses/sweep_ledger.json'
+MAX_POOL_BREAKS: int = 2
+
+# Relative cost of a hidden unit step per model family.
+_FAMILY_COSTS: {str: int} = {
+    utils.LSTMClassifier1: 4,
+    utils.GRUClassifier1: 3,
+    utils.RNNClassifier1: 1
+}
+
+
+def cost_of(config: utils.Config) -> float:
+    # Rough training cost: multiply-adds per token of the recurrent or convolutional stack, times epochs.
+    if config.model_name == utils.CNNClassifier1:
+        per_token = config.kernel_size * config.embs_dim * config.hidden_dim * (config.hidden_layers + 2)
+    else:
+        per_token = _FAMILY_COSTS[config.model_name] * config.hidden_layers * config.hidden_dim * \
+                    (config.embs_dim + config.hidden_dim) * (2 if config.is_bidirectional else 1)
+    return per_token * config.max_epochs
+
+
+class Ledger:
+    def __init__(self, path: str):
+        self.path: str = path
+        self.jobs: {str: dict} = utils.load_json(path) if os.path.isfile(path) else {}
+
+    def set(self, key: str, state: str, **info):
+        self.jobs[key] = {**self.jobs.get(key, {}), 'state': state, 'time': time.time(), **info}
+        tmp_path = f"{self.path}.tmp"
+        utils.dump_json(tmp_path, self.jobs)
+        os.replace(tmp_path, self.path)
+
+    def state_of(self, key: str) -> str:
+        return self.jobs.get(key, {}).get('state')
+
+
+def _init_worker(threads_per_worker: int):
+    if threads_per_worker is not None:
+        torch.set_num_threads(threads_per_worker)
+        torch.set_num_interop_threads(1)
+
+
+def _run_job(config_kwargs: dict) -> str:
+    config = utils.Config(**config_kwargs)
+    print(f"Training {config.session_loss_evo_path} on {config.device}", flush=True)
+    trainer.debug_training(config)
+    return config.session_loss_evo_path
+
+
+def run(configs_kwargs: [dict], num_workers: int = 1, threads_per_worker: int = None,
+        ledger_path: str = DEFAULT_LEDGER_PATH, retry_failed: bool = False) -> Ledger:
+    ledger = Ledger(ledger_path)
+    pending = []
+    for config_kwargs in configs_kwargs:
+        config = utils.Config(**config_kwargs)
+        key = config.session_loss_evo_path
+        state = ledger.state_of(key)
+        if state == DONE or trainer.is_training_complete(config):
+            # Also catches jobs that completed while the sweep crashed, before their 'done' was recorded.
+            print('Configuration already carried out:', key)
+            if state != DONE:
+                ledger.set(key, DONE)
+            continue
+        if state == FAILED and not retry_failed:
+            print('Configuration failed before, skipped:', key)
+            continue
+        # Queued, never seen, failed to be retried, or left running by a crashed sweep.
+        ledger.set(key, QUEUED, cost=cost_of(config))
+        pending.append((cost_of(config), key, config_kwargs))
+    pending.sort(key=lambda p: p[0])
+    threads_per_worker = threads_per_worker if threads_per_worker is not None \
+        else max(1, os.cpu_count() // num_workers)
+    print(f"Sweep of {len(pending)} configurations on {num_workers} workers of {threads_per_worker} threads")
+
+    breaks = {}
+
+    def requeue(job):
+        _, key, _ = job
+        breaks[key] = breaks.get(key, 0) + 1
+        if breaks[key] >= MAX_POOL_BREAKS:
+            ledger.set(key, FAILED, error=f"Worker died in {breaks[key]} runs.")
+            print('Configuration failed:', key)
+        else:
+            ledger.set(key, QUEUED)
+            pending.append(job)
+
+    # Spawned rather than forked: workers must not inherit the parent's torch thread pools.
+    context = multiprocessing.get_context('spawn')
+    while pending:
+        with ProcessPoolExecutor(max_workers=num_workers, mp_context=context, initializer=_init_worker,
+                                 initargs=(threads_per_worker,)) as pool:
+            running = {}
+            is_broken = False
+            while (pending or running) and not is_broken:
+                # Submitting no more jobs than workers keeps the ledger's 'running' state truthful.
+                while pending and len(running) < num_workers:
+                    job = pending.pop(0)
+                    try:
+                        running[pool.submit(_run_job, job[2])] = job
+                    except BrokenProcessPool:
+                        pending.insert(0, job)
+                        is_broken = True
+                        break
+                    ledger.set(job[1], RUNNING, started=time.time())
+                if not running:
+                    break
+                done, _ = wait(running.keys(), return_when=FIRST_COMPLETED)
+                for future in done:
+                    job = running.pop(future)
+                    try:
+                        future.result()
+                        ledger.set(job[1], DONE)
+                    except BrokenProcessPool:
+                        is_broken = True
+                        requeue(job)
+                    except Exception:
+                        ledger.set(job[1], FAILED, error=traceback.format_exc())
+                        print('Configuration failed:', job[1])
+            # The jobs still running in a broken pool are lost with it.
+            for job in running.values():
+                requeue(job)
+        if is_broken:
+            print('A worker died, restarting the pool.')
+            pending.sort(key=lambda p: p[0])
+    return ledger
@@ -0,0 +1,32 @@
+import os
+import importlib.util
+import pytest
+
+# Checks of the in-process lexers against the JVM ones, run from this directory: python -m pytest test_antlr_lexing.py
+# Skipped where the ANTLR runtime, the generated Python target lexers (see antlr_lexing.py) or the folds are missing.
+pytest.importorskip('torch')
+pytest.importorskip('antlr4')
+#
+import utils as utils
+import antlr_lexing as antlr_lexing
+
+if importlib.util.find_spec(antlr_lexing.GENERATED_PACKAGE) is None:
+    pytest.skip(f"Python target lexers not generated into '{antlr_lexing.GENERATED_PACKAGE}'.", allow_module_level=True)
+
+
+@pytest.mark.parametrize('lang_name', list(antlr_lexing.PYTHON_TARGET_LEXERS.keys()))
+def test_lex_ends_with_eof(lang_name: str):
+    source = 'int x = 1;\n'
+    token_ids, starts, stops = antlr_lexing.lex(source, lang_name)
+    assert (token_ids[-1], starts[-1], stops[-1]) == (antlr_lexing.EOF_TOKEN_RULE, len(source), len(source) - 1)
+    assert all(t != antlr_lexing.EOF_TOKEN_RULE for t in token_ids[:-1])
+
+
+@pytest.mark.parametrize('lang_name', list(antlr_lexing.PYTHON_TARGET_LEXERS.keys()))
+def test_parity_on_fold(lang_name: str):
+    jhetas_path = utils.Config(lang_name=lang_name).get_jhetas_testing_path_of_fold(0)
+    if not os.path.isfile(jhetas_path):
+        pytest.skip(f"No fold at {jhetas_path}.")
+    report = antlr_lexing.parity(lang_name, 0)
+    assert report['files'] > 0
+    assert report['mismatches'] == 0, report
@@ -0,0 +1,74 @@
+import threading
+import pytest
+
+# Padded batches must answer the hcodes of single forwards.
+pytest.importorskip('torch')
+import torch
+#
+import utils as utils
+import inference as inference
+import batcher as batcher
+
+LENGTHS = [17, 1, 64, 5, 0, 33, 33, 120, 2]
+
+
+@pytest.fixture(params=[
+    {'model_name': utils.CNNClassifier1, 'embs_dim': 8, 'hidden_dim': 8, 'hidden_layers': 2},
+    {'model_name': utils.RNNClassifier1, 'embs_dim': 8, 'hidden_dim': 8, 'is_bidirectional': True},
+    {'model_name': utils.GRUClassifier1, 'embs_dim': 8, 'hidden_dim': 8, 'hidden_layers': 2}
+])
+def config_and_model(request) -> (utils.Config, torch.nn.Module):
+    torch.manual_seed(0)
+    config = utils.Config(device=torch.device('cpu'), **request.param)
+    # Double precision: batched and single forwards must not flip near-tie argmaxes through rounding.
+    return config, config.new_model().double().eval()
+
+
+def _seqs_of(config: utils.Config) -> [torch.Tensor]:
+    return [torch.randint(0, config.input_dim, (n,), dtype=torch.long) for n in LENGTHS]
+
+
+def _single_predictions(model: torch.nn.Module, seqs: [torch.Tensor]) -> [[int]]:
+    return [inference.predict(model, seq, torch.device('cpu')).tolist() for seq in seqs]
+
+
+def test_predict_batch(config_and_model):
+    config, model = config_and_model
+    seqs = [seq for seq in _seqs_of(config) if len(seq) > 0]
+    with torch.no_grad():
+        ps = batcher.predict_batch(model, seqs, torch.device('cpu'))
+        assert [p.tolist() for p in ps] == _single_predictions(model, seqs)
+
+
+@pytest.mark.parametrize('max_batch_tokens, window_size', [(32_768, 256), (100, 4), (64, 1)])
+def test_predict_bucketed_keeps_order(config_and_model, max_batch_tokens: int, window_size: int):
+    config, model = config_and_model
+    seqs = _seqs_of(config)
+    with torch.no_grad():
+        ps = batcher.predict_bucketed(model, iter(seqs), torch.device('cpu'), max_batch_tokens=max_batch_tokens,
+                                      window_size=window_size)
+        assert [p.tolist() for p in ps] == _single_predictions(model, seqs)
+
+
+def test_dynamic_batcher(config_and_model):
+    config, model = config_and_model
+    seqs = _seqs_of(config)
+    with torch.no_grad():
+        expected = _single_predictions(model, seqs)
+    dynamic_batcher = batcher.DynamicBatcher(model, torch.device('cpu'), max_wait_ms=20, max_batch_tokens=256)
+    results = [None] * len(seqs)
+
+    def request(i: int):
+        results[i] = dynamic_batcher.predict(seqs[i]).tolist()
+
+    try:
+        threads = [threading.Thread(target=request, args=(i,)) for i in range(len(seqs))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        dynamic_batcher.close()
+    assert results == expected
+    with pytest.raises(batcher.BatcherClosedError):
+        dynamic_batcher.predict(seqs[0])
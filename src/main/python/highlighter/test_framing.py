@@ -0,0 +1,91 @@
+import io
+import os
+import struct
+import pytest
+
+# Protocol of 'main.py useframed': pipelined requests, responses possibly out of request order.
+pytest.importorskip('torch')
+pytest.importorskip('numpy')
+import numpy as np
+import torch
+#
+import utils as utils
+import inference as inference
+import framing as framing
+
+REQUEST_HEADER = struct.Struct('<Ii')
+RESPONSE_HEADER = struct.Struct('<IqI')
+
+
+@pytest.fixture
+def model() -> torch.nn.Module:
+    torch.manual_seed(0)
+    config = utils.Config(device=torch.device('cpu'), model_name=utils.CNNClassifier1, embs_dim=8, hidden_dim=8,
+                          hidden_layers=2)
+    # Double precision: batched and single forwards must not flip near-tie argmaxes through rounding.
+    return config.new_model().double().eval()
+
+
+def _request_of(request_id: int, token_ids: [int]) -> bytes:
+    return REQUEST_HEADER.pack(request_id, len(token_ids)) + np.asarray(token_ids, dtype='<i4').tobytes()
+
+
+def _serve(model: torch.nn.Module, requests: bytes) -> bytes:
+    # Requests are small enough to fit the pipe's buffer before serving starts.
+    read_fd, write_fd = os.pipe()
+    try:
+        os.write(write_fd, requests)
+        os.close(write_fd)
+        write_fd = None
+        outfile = io.BytesIO()
+        framing.serve(model, torch.device('cpu'), read_fd, outfile)
+        return outfile.getvalue()
+    finally:
+        os.close(read_fd)
+        if write_fd is not None:
+            os.close(write_fd)
+
+
+def _responses_of(data: bytes) -> [(int, [int])]:
+    responses = []
+    offset = 0
+    while offset < len(data):
+        request_id, ns, n = RESPONSE_HEADER.unpack_from(data, offset)
+        offset += RESPONSE_HEADER.size
+        responses.append((request_id, np.frombuffer(data, dtype='<i2', count=n, offset=offset).tolist()))
+        offset += 2 * n
+    return responses
+
+
+def test_responses_match_their_requests(model: torch.nn.Module):
+    lengths = {7: 40, 3: 5, 100: 17, 4_000_000_000: 0, 8: 1}
+    token_ids = {request_id: torch.randint(-1, 50, (n,)).tolist() for request_id, n in lengths.items()}
+    requests = b''.join(_request_of(request_id, ids) for request_id, ids in token_ids.items())
+    responses = _responses_of(_serve(model, requests + REQUEST_HEADER.pack(0, framing.END_OF_SESSION)))
+
+    assert sorted(request_id for request_id, _ in responses) == sorted(token_ids.keys())
+    # Pending requests are answered shortest first, not in request order.
+    assert [len(ps) for _, ps in responses] == sorted(lengths.values())
+    with torch.no_grad():
+        for request_id, ps in responses:
+            token_rules = torch.tensor(token_ids[request_id], dtype=torch.long) + 1
+            assert ps == inference.predict(model, token_rules, torch.device('cpu')).tolist()
+
+
+def test_single_request(model: torch.nn.Module):
+    token_ids = list(range(-1, 30))
+    responses = _responses_of(_serve(model, _request_of(5, token_ids) + REQUEST_HEADER.pack(5, framing.END_OF_SESSION)))
+    with torch.no_grad():
+        expected = inference.predict(model, torch.tensor(token_ids, dtype=torch.long) + 1, torch.device('cpu'))
+    assert responses == [(5, expected.tolist())]
+
+
+def test_session_ends_at_eof(model: torch.nn.Module):
+    # No end of session frame: the closed pipe ends the session after the pending requests.
+    responses = _responses_of(_serve(model, _request_of(1, [3, 4, 5])))
+    assert [request_id for request_id, _ in responses] == [1]
+
+
+def test_invalid_count_ends_session(model: torch.nn.Module):
+    with pytest.raises(ValueError):
+        _serve(model, REQUEST_HEADER.pack(1, -5))
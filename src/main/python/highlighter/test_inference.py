@@ -0,0 +1,86 @@
+import pytest
+
+# Chunked and incremental predictions must answer the hcodes of a single full forward.
+pytest.importorskip('torch')
+import torch
+#
+import utils as utils
+import cnn as cnn
+import inference as inference
+
+CNN_KWARGS = {'model_name': utils.CNNClassifier1, 'embs_dim': 8, 'hidden_dim': 8, 'hidden_layers': 2}
+RNN_KWARGS = {'model_name': utils.RNNClassifier1, 'embs_dim': 8, 'hidden_dim': 8, 'hidden_layers': 2}
+
+
+def _model_of(config_kwargs: dict) -> (utils.Config, torch.nn.Module):
+    torch.manual_seed(0)
+    config = utils.Config(device=torch.device('cpu'), **config_kwargs)
+    # Double precision: chunks of different lengths must not flip near-tie argmaxes through rounding.
+    return config, config.new_model().double().eval()
+
+
+def _full_forward(model: torch.nn.Module, token_rules: torch.Tensor) -> torch.Tensor:
+    return torch.argmax(model(token_rules), dim=1)
+
+
+@pytest.mark.parametrize('length', [1, 30, 31, 200, 457])
+def test_cnn_chunked_matches_full(length: int):
+    config, model = _model_of(CNN_KWARGS)
+    token_rules = torch.randint(0, config.input_dim, (length,), dtype=torch.long)
+    with torch.no_grad():
+        expected = _full_forward(model, token_rules)
+        for max_chunk_tokens in [2 * model.receptive_radius + 1, 64, 1_000]:
+            assert torch.equal(cnn.chunked_predict(model, token_rules, max_chunk_tokens), expected)
+            assert torch.equal(inference.predict(model, token_rules, torch.device('cpu'), max_chunk_tokens), expected)
+
+
+@pytest.mark.parametrize('length', [1, 50, 333])
+def test_rnn_chunked_matches_full(length: int):
+    config, model = _model_of(RNN_KWARGS)
+    token_rules = torch.randint(0, config.input_dim, (length,), dtype=torch.long)
+    with torch.no_grad():
+        expected = _full_forward(model, token_rules)
+        for max_chunk_tokens in [1, 7, 64]:
+            assert torch.equal(inference.predict(model, token_rules, torch.device('cpu'), max_chunk_tokens), expected)
+
+
+def test_chunk_must_hold_receptive_field():
+    _, model = _model_of(CNN_KWARGS)
+    with pytest.raises(ValueError):
+        inference.check_max_chunk_tokens(model, 2 * model.receptive_radius)
+    inference.check_max_chunk_tokens(model, 2 * model.receptive_radius + 1)
+    inference.check_max_chunk_tokens(model, 0)
+
+
+def test_empty_input():
+    _, model = _model_of(CNN_KWARGS)
+    with torch.no_grad():
+        assert len(inference.predict(model, torch.zeros(0, dtype=torch.long), torch.device('cpu'))) == 0
+
+
+@pytest.mark.parametrize('offset, removed, inserted', [
+    (0, 0, 3), (0, 5, 0), (100, 1, 1), (100, 0, 20), (150, 40, 2), (199, 1, 0), (200, 0, 5), (0, 200, 4)
+])
+def test_incremental_matches_full(offset: int, removed: int, inserted: int):
+    config, model = _model_of(CNN_KWARGS)
+    prev_token_rules = torch.randint(0, config.input_dim, (200,), dtype=torch.long)
+    inserted_token_rules = torch.randint(0, config.input_dim, (inserted,), dtype=torch.long)
+    with torch.no_grad():
+        prev_ps = _full_forward(model, prev_token_rules)
+        token_rules, ps, start, span_ps = cnn.incremental_predict(model, prev_token_rules, prev_ps, offset, removed,
+                                                                  inserted_token_rules)
+        assert torch.equal(token_rules, torch.cat((prev_token_rules[:offset], inserted_token_rules,
+                                                   prev_token_rules[offset + removed:])))
+        assert torch.equal(ps, _full_forward(model, token_rules))
+        assert torch.equal(ps[start:start + len(span_ps)], span_ps)
+
+
+def test_incremental_rejects_invalid_edit():
+    config, model = _model_of(CNN_KWARGS)
+    token_rules = torch.randint(0, config.input_dim, (10,), dtype=torch.long)
+    ps = torch.zeros(10, dtype=torch.long)
+    inserted = torch.zeros(0, dtype=torch.long)
+    with pytest.raises(ValueError):
+        cnn.incremental_predict(model, token_rules, ps, 8, 3, inserted)
+    with pytest.raises(ValueError):
+        cnn.incremental_predict(model, token_rules, ps[:9], 0, 0, inserted)
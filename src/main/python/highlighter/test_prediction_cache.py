@@ -0,0 +1,80 @@
+import uuid
+import pytest
+
+# Content-addressed prediction caches: hits, misses and eviction.
+pytest.importorskip('torch')
+pytest.importorskip('numpy')
+import torch
+#
+import prediction_cache as prediction_cache
+
+MODEL_KEY = ('model', 0, False, None)
+
+
+def _digest_of(token_ids: [int], model_key=MODEL_KEY) -> bytes:
+    return prediction_cache.digest_of(model_key, prediction_cache.token_ids_bytes_of(token_ids))
+
+
+def _hcodes(n: int) -> torch.Tensor:
+    return torch.arange(n, dtype=torch.long) % 12
+
+
+def test_digest_covers_model_and_tokens():
+    assert _digest_of([1, 2, 3]) == _digest_of([1, 2, 3])
+    assert _digest_of([1, 2, 3]) != _digest_of([1, 2, 4])
+    assert _digest_of([1, 2, 3]) != _digest_of([1, 2, 3], ('model', 1, False, None))
+
+
+def test_local_hit_and_miss():
+    cache = prediction_cache.PredictionCache(max_bytes=1 << 20)
+    digest = _digest_of([1, 2, 3])
+    assert cache.get(digest) is None
+    cache.put(digest, _hcodes(3))
+    assert cache.get(digest).tolist() == _hcodes(3).tolist()
+    assert cache.get(_digest_of([3, 2, 1])) is None
+    stats = cache.stats()
+    assert (stats['hits'], stats['misses'], stats['entries']) == (1, 2, 1)
+
+
+def test_local_evicts_least_recently_used():
+    # Room for two entries of 10 hcodes.
+    cache = prediction_cache.PredictionCache(max_bytes=2 * (prediction_cache._ENTRY_OVERHEAD_BYTES + 2 * 10))
+    a, b, c = _digest_of([1]), _digest_of([2]), _digest_of([3])
+    cache.put(a, _hcodes(10))
+    cache.put(b, _hcodes(10))
+    assert cache.get(a) is not None
+    cache.put(c, _hcodes(10))
+    assert cache.get(b) is None
+    assert cache.get(a) is not None and cache.get(c) is not None
+    assert cache.stats()['bytes'] <= cache.max_bytes
+
+
+def test_local_skips_oversized_entries():
+    cache = prediction_cache.PredictionCache(max_bytes=prediction_cache._ENTRY_OVERHEAD_BYTES + 2 * 10)
+    digest = _digest_of([1])
+    cache.put(digest, _hcodes(11))
+    assert cache.get(digest) is None
+    assert cache.stats()['entries'] == 0
+
+
+def test_shared_across_attachments():
+    owner = prediction_cache.SharedPredictionCache(f"test_{uuid.uuid4().hex[:16]}", num_slots=64, slot_bytes=64,
+                                                   create=True)
+    try:
+        attached = prediction_cache.SharedPredictionCache(owner.stats()['name'], num_slots=64, slot_bytes=64)
+        try:
+            digest = _digest_of([1, 2, 3])
+            assert attached.get(digest) is None
+            owner.put(digest, _hcodes(20))
+            assert attached.get(digest).tolist() == _hcodes(20).tolist()
+            # Larger than a slot: not cached.
+            large = _digest_of([4])
+            owner.put(large, _hcodes(33))
+            assert owner.get(large) is None
+            assert (attached.stats()['hits'], attached.stats()['misses']) == (1, 1)
+        finally:
+            attached.close()
+        # Closed: every get misses.
+        assert attached.get(_digest_of([1, 2, 3])) is None
+    finally:
+        owner.close()
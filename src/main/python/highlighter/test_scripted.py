@@ -0,0 +1,38 @@
+import os
+import pytest
+
+# Round trip of the TorchScript export: the artifact must answer the eager model's argmax hcodes.
+pytest.importorskip('torch')
+import torch
+#
+import utils as utils
+import scripted as scripted
+
+
+@pytest.fixture
+def work_dir(tmp_path, monkeypatch):
+    # Models and logs live in siblings of the working directory, as they do next to the sources.
+    for name in ['work', 'saved_models', 'saved_model_losses']:
+        os.makedirs(tmp_path / name)
+    monkeypatch.chdir(tmp_path / 'work')
+
+
+@pytest.mark.parametrize('config_kwargs', [
+    {'model_name': utils.CNNClassifier1, 'embs_dim': 8, 'hidden_dim': 16, 'hidden_layers': 2},
+    {'model_name': utils.RNNClassifier1, 'embs_dim': 8, 'hidden_dim': 16, 'is_bidirectional': True}
+])
+def test_export_matches_eager(work_dir, config_kwargs: dict):
+    config = utils.Config(device=torch.device('cpu'), **config_kwargs)
+    model = config.new_model()
+    config.save_model_iter(model, 0)
+    utils.dump_json(config.session_loss_evo_path, {'config': config.json_encode_config(), 'logs': {}})
+
+    path = scripted.export(config.session_loss_evo_path, 0)
+    exported_config, scripted_model = scripted.load(path, torch.device('cpu'))
+    assert exported_config['config_name'] == config.config_name
+
+    model.eval()
+    with torch.no_grad():
+        for length in [1, 5, 64, 333]:
+            token_rules = torch.randint(0, config.input_dim, (length,), dtype=torch.long)
+            assert torch.equal(scripted_model(token_rules), torch.argmax(model(token_rules), dim=1))
@@ -0,0 +1,39 @@
+import pytest
+
+# Character spans of /eval_model: runs of same generic hcode tokens, EOF left out.
+pytest.importorskip('torch')
+import torch
+#
+import spans as spans
+
+# Task hcodes 0, 1, 2 decode to generic hcodes 3, 5, 5.
+TASK_ADAPTER = ({}, {'0': 3, '1': 5, '2': 5})
+
+
+def _spans_of(ps: [int], starts: [int], stops: [int]) -> [int]:
+    span_starts, span_stops, span_hcodes = spans.char_spans_of(
+        torch.tensor(ps), spans.task_decoder_of(TASK_ADAPTER), torch.tensor(starts), torch.tensor(stops))
+    return spans.flat_spans_of(span_starts, span_stops, span_hcodes)
+
+
+def test_task_decoder():
+    assert spans.task_decoder_of(TASK_ADAPTER).tolist() == [3, 5, 5]
+
+
+def test_runs_merge_decoded_hcodes():
+    # 'int x = 1;': tokens 'int', 'x', '=', '1', ';' then EOF at [10, 9].
+    ps = [0, 1, 2, 2, 0, 0]
+    starts = [0, 4, 6, 8, 9, 10]
+    stops = [2, 4, 6, 8, 9, 9]
+    assert _spans_of(ps, starts, stops) == [0, 2, 3, 4, 8, 5, 9, 9, 3]
+
+
+def test_eof_is_left_out():
+    # EOF alone in its run adds no span.
+    assert _spans_of([0, 1], [0, 3], [2, 2]) == [0, 2, 3]
+    # EOF only: no character to cover.
+    assert _spans_of([1], [0], [-1]) == []
+
+
+def test_empty():
+    assert _spans_of([], [], []) == []
@@ -0,0 +1,42 @@
+import pytest
+
+# Binary wire format of /eval_model: token ids in, int16 hcodes out.
+pytest.importorskip('torch')
+pytest.importorskip('numpy')
+import numpy as np
+import torch
+#
+import wire as wire
+
+TOKEN_IDS = [-1, 0, 1, 7, 300, 32_767]
+
+
+@pytest.mark.parametrize('dtype_name', ['int16', 'int32'])
+def test_decode_round_trip(dtype_name: str):
+    body = np.asarray(TOKEN_IDS, dtype=wire.wire_dtype_of(dtype_name)).tobytes()
+    wire.check_body(body, dtype_name)
+    assert wire.decode_token_rules(body, dtype_name).tolist() == [t + 1 for t in TOKEN_IDS]
+    assert wire.canonical_token_ids_bytes(body, dtype_name) == np.asarray(TOKEN_IDS, dtype='<i4').tobytes()
+
+
+def test_decode_empty_body():
+    wire.check_body(b'')
+    assert len(wire.decode_token_rules(b'')) == 0
+
+
+def test_encode_hcodes():
+    ps = torch.tensor([0, 3, 11, 2], dtype=torch.long)
+    assert np.frombuffer(wire.encode_hcodes(ps), dtype='<i2').tolist() == ps.tolist()
+
+
+@pytest.mark.parametrize('dtype_name, size', [('int32', 7), ('int32', 2), ('int16', 3)])
+def test_partial_token_id_is_rejected(dtype_name: str, size: int):
+    with pytest.raises(ValueError):
+        wire.check_body(bytes(size), dtype_name)
+
+
+def test_unknown_dtype_is_rejected():
+    with pytest.raises(ValueError):
+        wire.wire_dtype_of('int64')
+    with pytest.raises(ValueError):
+        wire.decode_token_rules(bytes(8), 'float32')
@@ -0,0 +1,108 @@
+import os
+import time
+import fcntl
+import statistics
+import torch
+#
+import utils as utils
+
+# Input length -> intra-op threads policy of a model on this machine.
+# Short inputs do not amortise the fork/join cost of many threads while long ones need them: calibration times the
+# model on one input per length bucket with every candidate thread count, and keeps the fastest.
+LENGTH_BUCKETS: [int] = [32, 128, 512, 2_048, 8_192, 32_768]
+CALIBRATION_REPEATS: int = 5
+
+
+def policy_path_of(model_log_name: str, model_index: int, variant: str = None, max_threads: int = None) -> str:
+    # One policy per thread budget: pre-forked and sweep workers calibrate within their share of the cores.
+    variant_suffix = f".{variant}" if variant is not None else ''
+    max_threads = max_threads if max_threads is not None else torch.get_num_threads()
+    return f"../saved_models/{model_log_name}_{model_index}{variant_suffix}.{max_threads}threads.json"
+
+
+def _candidate_threads(max_threads: int) -> [int]:
+    threads = []
+    t = 1
+    while t < max_threads:
+        threads.append(t)
+        t *= 2
+    return threads + [max_threads]
+
+
+class ThreadPolicy:
+    def __init__(self, buckets: [(int, int)], num_cpus: int, max_threads: int):
+        # (bucket's max input length, threads) by ascending length; longer inputs use the last bucket's threads.
+        self.buckets: [(int, int)] = buckets
+        self.num_cpus: int = num_cpus
+        # Thread budget the policy was calibrated within.
+        self.max_threads: int = max_threads
+
+    def threads_for(self, length: int) -> int:
+        for max_length, threads in self.buckets:
+            if length <= max_length:
+                return threads
+        return self.buckets[-1][1]
+
+    def apply(self, length: int):
+        # Takes effect on the calling thread (OpenMP keeps a thread count per thread): apply it on the thread about to
+        # run the forward.
+        threads = self.threads_for(length)
+        if torch.get_num_threads() != threads:
+            torch.set_num_threads(threads)
+
+    def save(self, path: str):
+        # Atomically: concurrent loads never read a partial policy.
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        utils.dump_json(tmp_path, {'num_cpus': self.num_cpus, 'max_threads': self.max_threads, 'buckets': self.buckets})
+        os.replace(tmp_path, path)
+
+    @staticmethod
+    def load(path: str) -> 'ThreadPolicy':
+        policy = utils.load_json(path)
+        return ThreadPolicy([(int(m), int(t)) for m, t in policy['buckets']], int(policy['num_cpus']),
+                            int(policy.get('max_threads', 0)))
+
+    @staticmethod
+    def calibrate(model: torch.nn.Module, device, max_threads: int = None) -> 'ThreadPolicy':
+        max_threads = max_threads if max_threads is not None else torch.get_num_threads()
+        org_threads = torch.get_num_threads()
+        buckets = []
+        with torch.no_grad():
+            for length in LENGTH_BUCKETS:
+                # Timings do not depend on the token values.
+                token_rules = torch.ones(length, dtype=torch.long).to(device)
+                best_ns, best_threads = None, max_threads
+                for threads in _candidate_threads(max_threads):
+                    torch.set_num_threads(threads)
+                    model(token_rules)
+                    timings = []
+                    for _ in range(CALIBRATION_REPEATS):
+                        t0 = time.time_ns()
+                        model(token_rules)
+                        timings.append(time.time_ns() - t0)
+                    ns = statistics.median(timings)
+                    if best_ns is None or ns < best_ns:
+                        best_ns, best_threads = ns, threads
+                buckets.append((length, best_threads))
+        torch.set_num_threads(org_threads)
+        return ThreadPolicy(buckets, os.cpu_count(), max_threads)
+
+
+def thread_policy_of(model: torch.nn.Module, device, model_log_name: str, model_index: int,
+                     variant: str = None) -> ThreadPolicy:
+    # The policy persisted next to the model for this process' thread budget, calibrating (and persisting) it if
+    # missing or made on another machine. Processes needing the same policy calibrate it one at a time, so that their
+    # timings do not skew each other, and the later ones load it.
+    if torch.device(device).type != 'cpu':
+        return None
+    max_threads = torch.get_num_threads()
+    path = policy_path_of(model_log_name, model_index, variant=variant, max_threads=max_threads)
+    with open(f"{path}.lock", 'w') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        if os.path.isfile(path):
+            policy = ThreadPolicy.load(path)
+            if policy.num_cpus == os.cpu_count() and policy.max_threads == max_threads:
+                return policy
+        policy = ThreadPolicy.calibrate(model, device, max_threads=max_threads)
+        policy.save(path)
+        return policy
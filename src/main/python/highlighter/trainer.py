@@ -1,18 +1,25 @@
 import torch
+import numpy as np
 import utils as utils
 from sklearn.model_selection import KFold
+import os
 import random
 import math
+import time
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
 import evaluator as evaluator
+import training_data as training_data
 
 
 def train_one_epoch_on(inputs: [torch.Tensor], targets: [torch.Tensor], model: torch.nn.Module, loss_function,
-                       optimiser, device):
+                       optimiser, device, num_workers: int = 0, shuffle: bool = True):
     acc_loss = 0
     n = len(inputs)
-    for i, (x, y) in enumerate(zip(inputs, targets)):
-        x = x.detach().to(device)
-        y = y.detach().to(device)
+    loader = training_data.loader_of(inputs, targets, device, shuffle=shuffle, num_workers=num_workers)
+    for i, (x, y) in enumerate(loader):
+        x = x.detach().to(device, non_blocking=True)
+        y = y.detach().to(device, non_blocking=True)
 
         model.zero_grad()
         optimiser.zero_grad()
@@ -33,10 +40,61 @@ def train_one_epoch_on(inputs: [torch.Tensor], targets: [torch.Tensor], model: t
     return acc_loss
 
 
+def train_one_epoch_batched_on(inputs: [torch.Tensor], targets: [torch.Tensor], model: torch.nn.Module, loss_function,
+                               optimiser, device, batch_size: int, num_workers: int = 0, shuffle: bool = True):
+    # Mini-batch counterpart of 'train_one_epoch_on', over length-bucketed padded batches (see training_data.py).
+    # Padded targets are the loss' 'ignore_index': the loss averages over the batch's real tokens only.
+    acc_loss = 0
+    n = len(inputs)
+    done = 0
+    loader = training_data.loader_of(inputs, targets, device, shuffle=shuffle, num_workers=num_workers,
+                                     batch_size=batch_size, target_padding=loss_function.ignore_index)
+    for i, (xs, ys, lengths) in enumerate(loader):
+        xs = xs.to(device, non_blocking=True)
+        ys = ys.to(device, non_blocking=True)
+
+        model.zero_grad()
+        optimiser.zero_grad()
+        t = model.forward_batch(xs, lengths.to(device))
+        loss = loss_function(t.reshape(-1, t.shape[-1]), ys.reshape(-1))
+        loss.backward()
+        optimiser.step()
+        # Per file, as the accumulated loss of 'train_one_epoch_on'.
+        acc_loss += loss.item() * len(lengths)
+        done += len(lengths)
+
+        del xs
+        del ys
+
+        #
+        if i % 100 == 0:
+            print('\rTraining step:', ('%.2f' % (done * 100 / n)) + '%', 'completed. | Accumulated loss:',
+                  '%.2f' % acc_loss, end='\033[K')
+    print()
+    return acc_loss
+
+
+def train_one_epoch_of(config: utils.Config, inputs: [torch.Tensor], targets: [torch.Tensor], model: torch.nn.Module,
+                       loss_function, optimiser) -> (float, float):
+    # One epoch in the training mode of 'config' (per file, or mini-batches if its 'batch_size' is above 1), returning
+    # the accumulated loss and the training throughput in tokens/s.
+    t0 = time.time()
+    if config.batch_size > 1:
+        acc_loss = train_one_epoch_batched_on(inputs, targets, model, loss_function, optimiser, config.device,
+                                              config.batch_size, num_workers=config.loader_workers)
+    else:
+        acc_loss = train_one_epoch_on(inputs, targets, model, loss_function, optimiser, config.device,
+                                      num_workers=config.loader_workers)
+    tokens_per_s = sum(len(x) for x in inputs) / (time.time() - t0)
+    print(f"Epoch throughput: {tokens_per_s:.0f} tokens/s")
+    return acc_loss, tokens_per_s
+
+
 def test_on(inputs: [torch.Tensor], targets: [torch.Tensor], model: torch.nn.Module, loss_function, is_validation=False,
-            is_snip=False, device="cpu"):
-    inputs_dev = list(map(lambda inp: inp.detach().to(device), inputs))
-    targets_dev = list(map(lambda trg: trg.detach().to(device), targets))
+            is_snip=False, device="cpu", num_workers: int = 0):
+    loader = training_data.loader_of(inputs, targets, device, num_workers=num_workers)
+    pairs_dev = ((inp.detach().to(device, non_blocking=True), trg.detach().to(device, non_blocking=True))
+                 for inp, trg in loader)
 
     msg = 'Validation' if is_validation else 'Testing'
     if is_snip:
@@ -44,10 +102,7 @@ def test_on(inputs: [torch.Tensor], targets: [torch.Tensor], model: torch.nn.Mod
     model.eval()
     with torch.no_grad():
         avg_acc, loss_sum, errs_map, errs_obs, errs_hist, seqs_p = \
-            evaluator.acc_of_all(model, inputs_dev, targets_dev, loss_function, msg=msg)
-
-    del inputs_dev
-    del targets_dev
+            evaluator.acc_of_pairs(model, pairs_dev, len(inputs), loss_function, msg=msg)
 
     model.train()
     return {
@@ -60,52 +115,173 @@ def test_on(inputs: [torch.Tensor], targets: [torch.Tensor], model: torch.nn.Mod
     }
 
 
+def _rng_state() -> dict:
+    return {
+        'torch': torch.get_rng_state(),
+        'cuda': torch.cuda.get_rng_state_all() if torch.cuda.is_available() else None,
+        'random': random.getstate(),
+        'numpy': np.random.get_state()
+    }
+
+
+def _set_rng_state(state: dict):
+    torch.set_rng_state(state['torch'])
+    if state['cuda'] is not None and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all(state['cuda'])
+    random.setstate(state['random'])
+    np.random.set_state(state['numpy'])
+
+
+def save_checkpoint(config: utils.Config, fold_num: int, epochs_done: int, is_complete: bool, model: torch.nn.Module,
+                    optimiser, scheduler, logs: dict):
+    # Everything a resumed fold needs to continue as if never interrupted, random number generators included.
+    path = config.get_checkpoint_path_of_iter(fold_num)
+    torch.save({
+        'fold_num': fold_num,
+        'epochs_done': epochs_done,
+        'is_complete': is_complete,
+        'model': model.state_dict(),
+        'optimiser': optimiser.state_dict(),
+        'scheduler': scheduler.state_dict(),
+        'rng': _rng_state(),
+        'logs': logs
+    }, path + '.tmp')
+    os.replace(path + '.tmp', path)
+
+
+def load_checkpoint(config: utils.Config, fold_num: int) -> dict:
+    path = config.get_checkpoint_path_of_iter(fold_num)
+    # Not weights only (the default from torch 2.6): checkpoints hold rng states and logs too, and are our own files.
+    return torch.load(path, map_location='cpu', weights_only=False) if os.path.isfile(path) else None
+
+
+def remove_checkpoints(config: utils.Config):
+    for fold_num in range(3):
+        path = config.get_checkpoint_path_of_iter(fold_num)
+        if os.path.isfile(path):
+            os.remove(path)
+
+
+def is_training_complete(config: utils.Config) -> bool:
+    return os.path.isfile(config.session_loss_evo_path) and \
+        len(utils.load_json(config.session_loss_evo_path)['logs']) == 3
+
+
+def train_fold(config: utils.Config, fold_num: int) -> dict:
+    # Trains and evaluates a fresh model on the fold, saving it; returns the fold's logs.
+    # The fold is checkpointed after its initial evaluation, after every epoch and once complete: an interrupted fold
+    # resumes from its latest checkpoint, and a complete one only restores its logs and the random state it left.
+    train_inputs, train_targets = config.get_cache_training_of_fold(fold_num)
+    val_inputs, val_targets = config.get_cache_validation_of_fold(fold_num)
+    test_inputs, test_targets = config.get_cache_testing_of_fold(fold_num)
+    snip_test_inputs, snip_test_targets = config.get_cache_snippets_of_fold(fold_num)
+
+    model, optimiser, scheduler, loss_function = config.new_model_training_session()
+
+    print('Training size:', len(train_inputs), 'Validation size:', len(val_inputs), 'Test size:', len(test_inputs))
+
+    logs = {
+        'train_logs': [],
+        'train_tokens_per_s': [],
+        'val_logs': [],
+        'test_logs': [],
+        'snippets_losses': []}
+    train_losses = logs['train_logs']
+    train_tokens_per_s = logs['train_tokens_per_s']
+    val_losses = logs['val_logs']
+    test_losses = logs['test_logs']
+    snippets_losses = logs['snippets_losses']
+    #
+    checkpoint = load_checkpoint(config, fold_num)
+    if checkpoint is not None:
+        print(f"Resuming fold {fold_num} after {checkpoint['epochs_done']} epochs")
+        _set_rng_state(checkpoint['rng'])
+        if checkpoint['is_complete']:
+            return checkpoint['logs']
+        model.load_state_dict(checkpoint['model'])
+        optimiser.load_state_dict(checkpoint['optimiser'])
+        scheduler.load_state_dict(checkpoint['scheduler'])
+        for k, v in checkpoint['logs'].items():
+            logs[k].extend(v)
+        start_epoch = checkpoint['epochs_done']
+    else:
+        train_losses.append(test_on(train_inputs, train_targets, model, loss_function, is_validation=True,
+                                    device=config.device, num_workers=config.loader_workers))
+        val_losses.append(test_on(val_inputs, val_targets, model, loss_function, is_validation=True,
+                                  device=config.device, num_workers=config.loader_workers))
+        test_losses.append(test_on(test_inputs, test_targets, model, loss_function,
+                                   device=config.device, num_workers=config.loader_workers))
+        snippets_losses.append(test_on(snip_test_inputs, snip_test_targets, model, loss_function,
+                                       device=config.device, num_workers=config.loader_workers))
+        start_epoch = 0
+        save_checkpoint(config, fold_num, 0, False, model, optimiser, scheduler, logs)
+    for e in range(start_epoch, config.max_epochs):
+        acc_loss, tokens_per_s = train_one_epoch_of(config, train_inputs, train_targets, model, loss_function,
+                                                    optimiser)
+        train_losses.append(acc_loss)
+        train_tokens_per_s.append(tokens_per_s)
+
+        val_losses.append(
+            test_on(val_inputs, val_targets, model, loss_function, is_validation=True,
+                    device=config.device, num_workers=config.loader_workers)
+        )
+        if e < config.max_epochs - 1:
+            scheduler.step()
+        save_checkpoint(config, fold_num, e + 1, False, model, optimiser, scheduler, logs)
+
+    train_losses.append(test_on(train_inputs, train_targets, model, loss_function, is_validation=True,
+                                device=config.device, num_workers=config.loader_workers))
+    test_losses.append(test_on(test_inputs, test_targets, model, loss_function,
+                               device=config.device, num_workers=config.loader_workers))
+    snippets_losses.append(test_on(snip_test_inputs, snip_test_targets, model, loss_function, is_snip=True,
+                                   device=config.device, num_workers=config.loader_workers))
+
+    config.save_model_iter(model, fold_num)
+    save_checkpoint(config, fold_num, config.max_epochs, True, model, optimiser, scheduler, logs)
+    return logs
+
+
+def _init_fold_worker(threads: int):
+    # Once per fold process: the inter-op pool can not be resized after its first use.
+    torch.set_num_threads(threads)
+    torch.set_num_interop_threads(1)
+
+
+def _train_fold_job(config: utils.Config, fold_num: int) -> dict:
+    # Entry point of a fold: its own seed, since folds no longer share one stream.
+    if config.is_seeded:
+        torch.manual_seed(config.seed_code + fold_num)
+        random.seed(config.seed_code + fold_num)
+    return train_fold(config, fold_num)
+
+
 def debug_training(config: utils.Config):
+    # With 'config.fold_workers' above 1 the three folds train concurrently, each in its own process with an equal
+    # share of this process' threads (all the cores, or a sweep worker's budget), less one per loader worker of the
+    # fold. Concurrent folds are seeded per fold, hence do not reproduce the models of sequential runs.
+    logs = {}
+    if config.fold_workers > 1:
+        # There are three folds: more workers would idle.
+        fold_workers = min(config.fold_workers, 3)
+        threads = max(1, torch.get_num_threads() // fold_workers - config.loader_workers)
+        # Spawned rather than forked: fold processes must not inherit this process' torch thread pools.
+        with ProcessPoolExecutor(max_workers=fold_workers, mp_context=multiprocessing.get_context('spawn'),
+                                 initializer=_init_fold_worker, initargs=(threads,)) as pool:
+            futures = {pool.submit(_train_fold_job, config, fold_num): fold_num for fold_num in range(3)}
+            for future in as_completed(futures):
+                logs[futures[future]] = future.result()
+                utils.dump_json(config.session_loss_evo_path,
+                                {'config': config.json_encode_config(), 'logs': dict(sorted(logs.items()))})
+        remove_checkpoints(config)
+        return dict(sorted(logs.items()))
+
     config.seed_pytorch(torch)
     if config.is_seeded:
         random.seed(config.seed_code)
 
-    logs = {}
     for fold_num in range(3):
-        train_inputs, train_targets = config.get_cache_training_of_fold(fold_num)
-        val_inputs, val_targets = config.get_cache_validation_of_fold(fold_num)
-        test_inputs, test_targets = config.get_cache_testing_of_fold(fold_num)
-        snip_test_inputs, snip_test_targets = config.get_cache_snippets_of_fold(fold_num)
-
-        model, optimiser, scheduler, loss_function = config.new_model_training_session()
-
-        print('Training size:', len(train_inputs), 'Validation size:', len(val_inputs), 'Test size:', len(test_inputs))
-
-        train_losses = []
-        val_losses = []
-        test_losses = []
-        snippets_losses = []
-        #
-        train_losses.append(test_on(train_inputs, train_targets, model, loss_function, is_validation=True, device=config.device))
-        val_losses.append(test_on(val_inputs, val_targets, model, loss_function, is_validation=True, device=config.device))
-        test_losses.append(test_on(test_inputs, test_targets, model, loss_function, device=config.device))
-        snippets_losses.append(test_on(snip_test_inputs, snip_test_targets, model, loss_function, device=config.device))
-        for e in range(config.max_epochs):
-            train_losses.append(
-                train_one_epoch_on(train_inputs, train_targets, model, loss_function, optimiser, config.device)
-            )
-
-            val_losses.append(
-                test_on(val_inputs, val_targets, model, loss_function, is_validation=True, device=config.device)
-            )
-            if e < config.max_epochs - 1:
-                scheduler.step()
-
-        train_losses.append(test_on(train_inputs, train_targets, model, loss_function, is_validation=True, device=config.device))
-        test_losses.append(test_on(test_inputs, test_targets, model, loss_function, device=config.device))
-        snippets_losses.append(test_on(snip_test_inputs, snip_test_targets, model, loss_function, is_snip=True, device=config.device))
-
-        logs[fold_num] = {
-            'train_logs': train_losses,
-            'val_logs': val_losses,
-            'test_logs': test_losses,
-            'snippets_losses': snippets_losses}
+        logs[fold_num] = train_fold(config, fold_num)
         utils.dump_json(config.session_loss_evo_path, {'config': config.json_encode_config(), 'logs': logs})
-        config.save_model_iter(model, fold_num)
+    remove_checkpoints(config)
 
     return logs
@@ -0,0 +1,89 @@
+import torch
+
+# Loading of fold caches for training and evaluation.
+# Files go through a torch DataLoader: with workers, the next files are prepared in the background while the model
+# computes, and are staged in pinned memory for asynchronous copies when training on cuda.
+#
+# Mini-batches of training files.
+# Files are shuffled, then sorted by length within pools of POOL_BATCHES batches, so that the files of a batch have
+# similar lengths (little padding) while batches still differ from epoch to epoch; the order of the batches is
+# shuffled too. A batch holds at most 'batch_size' files and 'max_batch_tokens' padded tokens, but always one file.
+POOL_BATCHES: int = 50
+MAX_BATCH_TOKENS: int = 32_768
+
+
+class LengthBucketBatchSampler(torch.utils.data.Sampler):
+    def __init__(self, lengths: [int], batch_size: int, max_batch_tokens: int = MAX_BATCH_TOKENS,
+                 shuffle: bool = True):
+        # No call to Sampler's constructor: it only takes a data source, required up to torch 2.1 (the pinned 2.0.1
+        # included) and deprecated from 2.2, and keeps nothing of it.
+        self.lengths: [int] = lengths
+        self.batch_size: int = batch_size
+        self.max_batch_tokens: int = max_batch_tokens
+        self.shuffle: bool = shuffle
+
+    def _batches(self) -> [[int]]:
+        n = len(self.lengths)
+        order = torch.randperm(n).tolist() if self.shuffle else list(range(n))
+        pool_size = self.batch_size * POOL_BATCHES
+        batches = []
+        for p in range(0, n, pool_size):
+            pool = sorted(order[p:p + pool_size], key=lambda i: self.lengths[i])
+            batch = []
+            for i in pool:
+                # Sorted pool: the file joining last is the longest of the batch.
+                if len(batch) > 0 and (len(batch) == self.batch_size or
+                                       (len(batch) + 1) * self.lengths[i] > self.max_batch_tokens):
+                    batches.append(batch)
+                    batch = []
+                batch.append(i)
+            if len(batch) > 0:
+                batches.append(batch)
+        if self.shuffle:
+            batches = [batches[b] for b in torch.randperm(len(batches)).tolist()]
+        return batches
+
+    def __iter__(self):
+        return iter(self._batches())
+
+
+class FoldDataset(torch.utils.data.Dataset):
+    def __init__(self, inputs: [torch.Tensor], targets: [torch.Tensor]):
+        self.inputs: [torch.Tensor] = inputs
+        self.targets: [torch.Tensor] = targets
+
+    def __len__(self) -> int:
+        return len(self.inputs)
+
+    def __getitem__(self, i: int) -> (torch.Tensor, torch.Tensor):
+        return self.inputs[i], self.targets[i]
+
+
+class PaddedCollate:
+    # Right-padded (batch, max_len) inputs and targets, and the true lengths; padded targets are 'target_padding',
+    # the 'ignore_index' of the loss. A class rather than a closure, so that loader workers can unpickle it.
+
+    def __init__(self, target_padding: int):
+        self.target_padding: int = target_padding
+
+    def __call__(self, items: [(torch.Tensor, torch.Tensor)]) -> (torch.Tensor, torch.Tensor, torch.Tensor):
+        inputs, targets = zip(*items)
+        lengths = torch.tensor([len(x) for x in inputs], dtype=torch.long)
+        xs = torch.nn.utils.rnn.pad_sequence(list(inputs), batch_first=True)
+        ys = torch.nn.utils.rnn.pad_sequence(list(targets), batch_first=True, padding_value=self.target_padding)
+        return xs, ys, lengths
+
+
+def loader_of(inputs: [torch.Tensor], targets: [torch.Tensor], device, shuffle: bool = False, num_workers: int = 0,
+              batch_size: int = 1, target_padding: int = -100) -> torch.utils.data.DataLoader:
+    # Yields (input, target) pairs of single files, or padded (inputs, targets, lengths) mini-batches for a
+    # 'batch_size' above 1. Shuffled loaders draw a new order at every iteration, i.e. every epoch.
+    dataset = FoldDataset(inputs, targets)
+    pin_memory = torch.device(device).type == 'cuda'
+    if batch_size > 1:
+        return torch.utils.data.DataLoader(
+            dataset, batch_sampler=LengthBucketBatchSampler([len(x) for x in inputs], batch_size, shuffle=shuffle),
+            collate_fn=PaddedCollate(target_padding), num_workers=num_workers, pin_memory=pin_memory)
+    # No batch dimension: files come as they are.
+    return torch.utils.data.DataLoader(dataset, batch_size=None, shuffle=shuffle, num_workers=num_workers,
+                                       pin_memory=pin_memory)
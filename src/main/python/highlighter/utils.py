@@ -167,6 +167,24 @@ def from_cache(name: str) -> ([torch.Tensor], [torch.Tensor]):
     return tmp
 
 
+def so_loc_stats_of(lang_name: str) -> (float, float, int, int):
+    # Mean, std, min and max lines of code of StackOverflow snippets of the language.
+    if lang_name == JAVA_LANG_NAME:
+        return SO_JAVA_MEAN, SO_JAVA_STD, SO_JAVA_MIN, SO_JAVA_MAX
+    elif lang_name == KOTLIN_LANG_NAME:
+        return SO_KOTLIN_MEAN, SO_KOTLIN_STD, SO_KOTLIN_MIN, SO_KOTLIN_MAX
+    elif lang_name == PYTHON3_LANG_NAME:
+        return SO_PYTHON_MEAN, SO_PYTHON_STD, SO_PYTHON_MIN, SO_PYTHON_MAX
+    elif lang_name == CPP_LANG_NAME:
+        return SO_CPP_MEAN, SO_CPP_STD, SO_CPP_MIN, SO_CPP_MAX
+    elif lang_name == CS_LANG_NAME:
+        return SO_CS_MEAN, SO_CS_STD, SO_CS_MIN, SO_CS_MAX
+    elif lang_name == JS_LANG_NAME:
+        return SO_JS_MEAN, SO_JS_STD, SO_JS_MIN, SO_JS_MAX
+    else:
+        raise ValueError(f"Unknown language '{lang_name}'.")
+
+
 def load_json(filename: str):
     tmp = None
     with open(filename, 'r') as f:
@@ -261,10 +279,20 @@ class Config:
             device=torch.device('cuda:0' if torch.cuda.is_available() else 'cpu'),
             # cnn params
             kernel_size: int = 3,
-            dropout: float = 0.5
+            dropout: float = 0.5,
+            # training files per step: 1 steps on every file, larger sizes train on padded mini-batches
+            batch_size: int = 1,
+            # background processes preparing the next files (0 loads them in the training process): the files are
+            # already in memory, so workers only pay off for padded mini-batches or pinned copies to cuda
+            loader_workers: int = 0,
+            # processes training the folds concurrently (1 trains them one after another)
+            fold_workers: int = 1
     ):
         self.kernel_size = kernel_size
         self.dropout = dropout
+        self.batch_size: int = batch_size
+        self.loader_workers: int = loader_workers
+        self.fold_workers: int = fold_workers
         self.is_seeded: bool = is_seeded
         self.seed_code: int = seed_code
         if is_seeded:
@@ -329,7 +357,8 @@ class Config:
             str(self.hidden_layers) + 'hl_' + \
             str(self.is_bidirectional) + 'bid' + \
             str(self.kernel_size) + 'kernel' + \
-            str(self.dropout) + 'dropout'
+            str(self.dropout) + 'dropout' + \
+            (str(self.batch_size) + 'bs' if self.batch_size > 1 else '')
         #
         runc: str = str(self.run_code)
         taskc: str = str(task_code_of(self.task))
@@ -411,38 +440,7 @@ class Config:
                 f"Fold {foldid}: Training:', {len(train_is)}, 'Validation:', {len(val_is)}, 'Test size:', {len(test_is)}")
 
     def generate_folds_snippets(self, number_of_snippets=5000):
-        if self.lang_name == JAVA_LANG_NAME:
-            LOC_mean: float = SO_JAVA_MEAN
-            LOC_std: float = SO_JAVA_STD
-            LOC_min: int = SO_JAVA_MIN
-            LOC_max: int = SO_JAVA_MAX
-        elif self.lang_name == KOTLIN_LANG_NAME:
-            LOC_mean: float = SO_KOTLIN_MEAN
-            LOC_std: float = SO_KOTLIN_STD
-            LOC_min: int = SO_KOTLIN_MIN
-            LOC_max: int = SO_KOTLIN_MAX
-        elif self.lang_name == PYTHON3_LANG_NAME:
-            LOC_mean: float = SO_PYTHON_MEAN
-            LOC_std: float = SO_PYTHON_STD
-            LOC_min: int = SO_PYTHON_MIN
-            LOC_max: int = SO_PYTHON_MAX
-        elif self.lang_name == CPP_LANG_NAME:
-            LOC_mean: float = SO_CPP_MEAN
-            LOC_std: float = SO_CPP_STD
-            LOC_min: int = SO_CPP_MIN
-            LOC_max: int = SO_CPP_MAX
-        elif self.lang_name == CS_LANG_NAME:
-            LOC_mean: float = SO_CS_MEAN
-            LOC_std: float = SO_CS_STD
-            LOC_min: int = SO_CS_MIN
-            LOC_max: int = SO_CS_MAX
-        elif self.lang_name == JS_LANG_NAME:
-            LOC_mean: float = SO_JS_MEAN
-            LOC_std: float = SO_JS_STD
-            LOC_min: int = SO_JS_MIN
-            LOC_max: int = SO_JS_MAX
-        else:
-            raise ValueError(f"Unknown language '{self.lang_name}'.")
+        LOC_mean, LOC_std, LOC_min, LOC_max = so_loc_stats_of(self.lang_name)
 
         for foldid in range(3):
             jhetas_testing = load_json(self.get_jhetas_testing_path_of_fold(foldid))
@@ -567,7 +565,8 @@ class Config:
             step_size=self.lr_step_size,
             gamma=self.lr_gamma,
             verbose=True)
-        loss_func = torch.nn.CrossEntropyLoss()
+        # Padded targets of mini-batches do not count towards the loss.
+        loss_func = torch.nn.CrossEntropyLoss(ignore_index=self.padding_token)
         return model, optimiser, scheduler, loss_func
 
     def seed_pytorch(self, t):
@@ -577,6 +576,9 @@ class Config:
     def _model_path_of_iter(self, iter: int):
         return self.module_path.replace('.pt', '_' + str(iter) + '.pt')
 
+    def get_checkpoint_path_of_iter(self, iter: int) -> str:
+        return self._model_path_of_iter(iter).replace('.pt', '.ckpt.pt')
+
     def save_model_iter(self, model: torch.nn.Module, iter: int):
         torch.save(model.state_dict(), self._model_path_of_iter(iter))
 
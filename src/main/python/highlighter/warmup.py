@@ -0,0 +1,52 @@
+import time
+import torch
+#
+import utils as utils
+import inference as inference
+import batcher as batcher
+
+# Warm-up of a freshly loaded model, before it serves real requests.
+# The first forwards of a model pay for allocator growth, oneDNN kernel selection and the first touch of its weights.
+# Warm-up evaluates a round of inputs at lengths representative of the language's snippets, then repeats rounds until
+# one is no slower than STEADY_STATE_RATIO times the previous one (or MAX_ROUNDS are done).
+# Snippet statistics are in lines of code: TOKENS_PER_LINE turns them into token counts.
+TOKENS_PER_LINE: int = 8
+STEADY_STATE_RATIO: float = 1.1
+MAX_ROUNDS: int = 10
+# Snippet sizes, in standard deviations from the mean, besides the min and max.
+_STD_OFFSETS: [float] = [0, 1, 2, 4]
+
+
+def warmup_lengths_of(lang_name: str) -> [int]:
+    loc_mean, loc_std, loc_min, loc_max = utils.so_loc_stats_of(lang_name)
+    locs = [loc_min, loc_max] + [loc_mean + k * loc_std for k in _STD_OFFSETS]
+    return sorted({max(1, round(loc * TOKENS_PER_LINE)) for loc in locs})
+
+
+def _round(entry, lengths: [int]):
+    # Along the paths serving uses: thread policy, single (or chunked) forwards and padded batches.
+    seqs = [torch.ones(length, dtype=torch.long) for length in lengths]
+    for token_rules in seqs:
+        if entry.thread_policy is not None:
+            entry.thread_policy.apply(len(token_rules))
+        inference.predict(entry.model, token_rules, entry.device, entry.max_chunk_tokens)
+    if entry.batcher is not None and hasattr(entry.model, 'forward_batch'):
+        batcher.predict_batch(entry.model, seqs, entry.device)
+
+
+def warm_up(entry) -> (int, int):
+    # Warms up the registered model 'entry', returning the warm-up time in ns and the number of rounds.
+    lengths = warmup_lengths_of(entry.key[0])
+    t0 = time.time_ns()
+    prev_ns = None
+    rounds = 0
+    with torch.no_grad():
+        while rounds < MAX_ROUNDS:
+            r0 = time.time_ns()
+            _round(entry, lengths)
+            round_ns = time.time_ns() - r0
+            rounds += 1
+            if prev_ns is not None and round_ns <= STEADY_STATE_RATIO * prev_ns:
+                break
+            prev_ns = round_ns
+    return time.time_ns() - t0, rounds
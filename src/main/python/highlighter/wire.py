@@ -0,0 +1,47 @@
+import numpy as np
+import torch
+
+# Binary wire format of /eval_model.
+#   Request body: packed little-endian signed token ids (raw lexer token rules, EOF=-1), int32 unless the
+#   'X-Token-Dtype' header says 'int16'.
+#   Response body: packed little-endian int16 hcodes, one per input token; the compute time travels in the 'X-Ns'
+#   header.
+BINARY_CONTENT_TYPE: str = 'application/octet-stream'
+TOKEN_DTYPE_HEADER: str = 'X-Token-Dtype'
+NS_HEADER: str = 'X-Ns'
+#
+_WIRE_DTYPES: {str: np.dtype} = {
+    'int16': np.dtype('<i2'),
+    'int32': np.dtype('<i4'),
+}
+_HCODES_WIRE_DTYPE: np.dtype = np.dtype('<i2')
+
+
+def wire_dtype_of(name: str) -> np.dtype:
+    dtype = _WIRE_DTYPES.get(name)
+    if dtype is None:
+        raise ValueError(f"Unknown wire dtype '{name}', expected one of {list(_WIRE_DTYPES.keys())}.")
+    return dtype
+
+
+def check_body(body: bytes, dtype_name: str = 'int32'):
+    # A body must hold whole token ids of its wire dtype.
+    itemsize = wire_dtype_of(dtype_name).itemsize
+    if len(body) % itemsize != 0:
+        raise ValueError(f"Body of {len(body)} bytes is not a whole number of {dtype_name} token ids.")
+
+
+def decode_token_rules(body: bytes, dtype_name: str = 'int32') -> torch.Tensor:
+    # Returns the non negative model input (token ids + 1), without any per-element Python work.
+    ids = np.frombuffer(body, dtype=wire_dtype_of(dtype_name))
+    return torch.from_numpy(ids.astype(np.int64)) + 1
+
+
+def encode_hcodes(ps: torch.Tensor) -> bytes:
+    return ps.cpu().numpy().astype(_HCODES_WIRE_DTYPE, copy=False).tobytes()
+
+
+def canonical_token_ids_bytes(body: bytes, dtype_name: str = 'int32') -> bytes:
+    # The request's token ids as packed little-endian int32, whatever their wire dtype.
+    dtype = wire_dtype_of(dtype_name)
+    return body if dtype == _WIRE_DTYPES['int32'] else np.frombuffer(body, dtype=dtype).astype('<i4').tobytes()